@@ -4,23 +4,42 @@ Community Winds app
 
 # pylint: disable=invalid-name, line-too-long, too-many-arguments
 import os
-import copy
 import math
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 import dash
-from dash.dependencies import Input, Output
-import pandas as pd
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import numpy as np
 from gui import layout
 import luts
-
-# Read data blobs and other items used from env
-data = pd.read_csv("roses.csv")
-calms = pd.read_csv("calms.csv")
-monthly_means = pd.read_csv("monthly_averages.csv")
-future_rose = pd.read_csv("future_roses.csv")
-percentiles = pd.read_csv("percentiles.csv", index_col=0)
+import datasets
+import cache
+import figure_store
+
+# Read data blobs and other items used from env.  With
+# CW_LAZY_DATA=1, the tables only some charts need are loaded
+# when first used, so workers boot faster.
+lazy = os.getenv("CW_LAZY_DATA") == "1"
+
+# Partition the tables once by the keys callbacks look
+# them up with, so requests don't scan whole tables.
+data = datasets.partitions("roses", ["sid", "month"])
+calms = datasets.partitions("calms", "sid")
+monthly_means = datasets.partitions("monthly_averages", "sid")
+future_rose = datasets.partitions(
+    "future_roses", ["sid", "gcm", "decadal_group"], lazy=lazy
+)
+threshold = datasets.pivots(
+    "threshold_events",
+    {
+        "events": (["stid", "gcm", "dur_thr", "percentile", "ts"], "events"),
+        "speeds": (["stid", "gcm", "percentile"], "ws_thr"),
+    },
+    lazy=lazy,
+)
+deltas = datasets.partitions("delta_percentiles", ["stid", "gcm", "decade"], lazy=lazy)
+cache.data_version = datasets.data_version()
+figure_store.open_store(cache.data_version)
 
 app = dash.Dash(__name__)
 
@@ -103,128 +122,190 @@ def update_place_dropdown(selected_on_map):
     return "PAFA"
 
 
-@app.callback(Output("map", "figure"), [Input("communities-dropdown", "value")])
-def update_selected_community_on_map(community):
-    """Draw a second trace on the map with one community highlighted."""
-    return {
-        "data": [
-            luts.map_communities_trace,
-            go.Scattermapbox(
-                lat=[luts.communities.loc[community]["latitude"]],
-                lon=[luts.communities.loc[community]["longitude"]],
-                mode="markers",
-                marker={"size": 20, "color": "rgb(207, 38, 47)"},
-                line={"color": "rgb(0, 0, 0)", "width": 2},
-                text=luts.communities.loc[community]["place"],
-                hoverinfo="text",
-            ),
-        ],
-        "layout": luts.map_layout,
-    }
-
-
-@app.callback(Output("means_box", "config"), [Input("communities-dropdown", "value")])
-def update_export_filenames(community):
-    """Update filename for file exports"""
-    c_name = luts.communities.loc[community]["place"]
-    configs = luts.fig_configs
-    i_configs = luts.fig_download_configs
-    i_configs["filename"] = c_name + " Average Wind Speeds, 1980-2014"
-    i_configs["height"] = "640"
-    configs["toImageButtonOptions"] = i_configs
-    return configs
+# Map highlighting and download filenames only need the places
+# table, which is in the "client-data" store: update them in the
+# browser (assets/50_clientside.js) rather than with a request.
+app.clientside_callback(
+    ClientsideFunction(namespace="cw", function_name="highlightCommunity"),
+    Output("map", "figure"),
+    [Input("communities-dropdown", "value")],
+    [State("map", "figure"), State("client-data", "data")],
+)
+app.clientside_callback(
+    ClientsideFunction(namespace="cw", function_name="updateExportFilenames"),
+    [Output(chart, "config") for chart in luts.export_options],
+    [Input("communities-dropdown", "value")],
+    [State("client-data", "data")],
+)
 
 
-@app.callback(Output("rose", "config"), [Input("communities-dropdown", "value")])
-def update_rose_export_filenames(community):
-    """Update filename for file exports"""
-    c_name = luts.communities.loc[community]["place"]
-    configs = luts.fig_configs
-    i_configs = luts.fig_download_configs
-    i_configs["filename"] = (
-        c_name + " Wind Frequency and Strength by Direction, 1980-2014"
-    )
-    i_configs["width"] = "1280"
-    i_configs["height"] = "1280"
-    configs["toImageButtonOptions"] = i_configs
-    return configs
+def get_rose_traces(d, traces, subplot=None, showlegend=False):
+    """
+    Get all traces for a wind rose, given the data chunk,
+    and return the maximum extent of any petal.  `subplot`
+    ties the traces to a subplot of a multiple-subplot graph.
+
+    The chunk has a row for every direction class and speed
+    range, by direction then speed range (see preprocess.py),
+    so it's read as a matrix of directions x speed ranges.
+    Traces are plain dicts, which skips Plotly's validation.
+    """
+    speed_range_count = len(luts.speed_ranges)
+    frequencies = d["frequency"].to_numpy().reshape(-1, speed_range_count)
+    theta = d["direction_class"].to_numpy()[::speed_range_count] * 10
 
+    # Directly mutate the `traces` array.
+    for k, (sr, sr_info) in enumerate(luts.speed_ranges.items()):
+        trace = dict(
+            type="barpolar",
+            r=frequencies[:, k],
+            theta=theta,
+            name=sr + " mph",
+            hovertemplate="%{r} %{fullData.name} winds from %{theta}<extra></extra>",
+            marker=dict(color=sr_info["color"]),
+            showlegend=showlegend,
+            legendgroup="legend",
+        )
+        if subplot is not None:
+            trace["subplot"] = subplot
+        traces.append(trace)
 
-@app.callback(
-    Output("rose_monthly", "config"), [Input("communities-dropdown", "value")]
+    # Compute the maximum extent of any particular
+    # petal on the wind rose.
+    petals = frequencies.sum(axis=1)
+    return petals.max() if petals.size else np.nan
+
+
+# Styling of the polar subplots in the rose grids.  The radial
+# axis range and step and the hole (% calm) depend on the data.
+rose_grid_polar = dict(
+    bgcolor="#fff",
+    angularaxis=dict(
+        tickmode="array",
+        tickvals=[0, 45, 90, 135, 180, 225, 270, 315],
+        ticktext=["N", "NE", "E", "SE", "S", "SW", "W", "NW"],
+        tickfont=dict(color="#444", size=10),
+        showticksuffix="last",
+        showline=False,  # no boundary circles
+        color="#888",  # set most colors to #888
+        gridcolor="#efefef",
+        rotation=90,  # align compass to north
+        direction="clockwise",  # degrees go clockwise
+    ),
+    radialaxis=dict(
+        color="#888",
+        gridcolor="#efefef",
+        tickangle=0,
+        tick0=1,
+        ticksuffix="%",
+        showticksuffix="last",
+        showline=False,  # hide the dark axis line
+        tickfont=dict(color="#444"),
+    ),
 )
-def update_monthly_rose_export_filenames(community):
-    """Update filename for file exports"""
-    c_name = luts.communities.loc[community]["place"]
-    configs = luts.fig_configs
-    i_configs = luts.fig_download_configs
-    i_configs["filename"] = (
-        c_name + " Monthly Wind Frequency and Strength by Direction, 1980-2014"
-    )
-    i_configs["width"] = "1024"
-    i_configs["height"] = "1280"
-    configs["toImageButtonOptions"] = i_configs
-    return configs
 
 
-def get_rose_calm_month_annotations(titles, calm):
+def get_rose_grid_layout(
+    rows, cols, titles, title_offset, vertical_spacing=None, **layout
+):
     """
-    Return a list of correctly-positioned %calm indicators
-    for the monthly wind rose charts.
-    Take the already-generated list of titles and use
-    that pixel geometry to position the %calm info.
+    Build the parts of the layout of a grid of wind roses
+    which don't depend on the data: subplot domains, subplot
+    titles (which are annotations) and styling.  These are
+    built once, see get_rose_grid_figure for the rest.
     """
-    calm_annotations = copy.deepcopy(titles)
-
-    k = 0
-    for anno in calm_annotations:
-        anno["y"] = anno["y"] - 0.1225
-        anno["font"] = {"color": "#000", "size": 10}
-        calm_text = str(int(round(calm.iloc[k]["percent"] * 100))) + "%"
-        if calm.iloc[k]["percent"] > 0.2:
-            # If there's enough room, add the "calm" text fragment
-            calm_text += " calm"
 
-        anno["text"] = calm_text
-        k += 1
+    # t = top margin in % of figure.
+    subplot_spec = dict(type="polar", t=0.01)
+    fig = make_subplots(
+        rows=rows,
+        cols=cols,
+        horizontal_spacing=0.03,
+        vertical_spacing=vertical_spacing,
+        specs=[[subplot_spec] * cols] * rows,
+        subplot_titles=titles,
+    )
+
+    # Apply formatting to subplot titles,
+    # which are actually annotations.
+    for i in fig["layout"]["annotations"]:
+        i["y"] = i["y"] + title_offset
+        i["font"] = dict(size=12, color="#444")
+        i["text"] = "<b>" + i["text"] + "</b>"
 
-    return calm_annotations
+    # Subplots are named polar, polar2, ... row by row.
+    fig.update_layout(
+        {
+            "polar" + (str(k) if k > 1 else ""): rose_grid_polar
+            for k in range(1, rows * cols + 1)
+        },
+        title=dict(font=dict(family="Open Sans", size=18), x=0.5),
+        font=dict(family="Open Sans", size=10),
+        legend=dict(x=0, y=0, orientation="h"),
+        paper_bgcolor="#fff",
+        plot_bgcolor="#fff",
+        **layout,
+    )
+    return fig.layout.to_plotly_json()
 
 
-def get_rose_traces(d, traces, month, showlegend=False):
+def get_rose_grid_figure(grid_layout, traces, title, max_axes, calms, calm_offset):
     """
-    Get all traces for a wind rose, given the data chunk.
-    Month is used to tie the subplot to the formatting
-    chunks in the multiple-subplot graph.
+    Return a wind rose grid figure: the `traces`, with a copy of
+    `grid_layout` filled in with the `title`, the radial axes
+    fitting the largest petal and the % calm of each rose, as
+    hole sizes and as labels `calm_offset` below the titles.
+    The copy is shallow, the parts from `grid_layout` are shared
+    and must not be modified.
     """
 
-    # Directly mutate the `traces` array.
-    for sr, sr_info in luts.speed_ranges.items():
-        dcr = d.loc[(d["speed_range"] == sr)]
-        props = dict(
-            r=dcr["frequency"].tolist(),
-            theta=pd.to_numeric(dcr["direction_class"]) * 10,
-            name=sr + " mph",
-            hovertemplate="%{r} %{fullData.name} winds from %{theta}<extra></extra>",
-            marker_color=sr_info["color"],
-            showlegend=showlegend,
-            legendgroup="legend",
+    # Determine maximum r-axis and r-step.
+    # Adding one and using floor(/2.5) was the
+    # result of experimenting with values that yielded
+    # about 3 steps in most cases, with a little headroom
+    # for the r-axis outer ring.
+    rmaxf = np.nanmax(max_axes) + 1
+    rstep = math.floor(rmaxf / 2.5)
+
+    layout = dict(grid_layout)
+    layout["title"] = {**grid_layout["title"], "text": title}
+
+    titles = grid_layout["annotations"]
+    calm_annotations = []
+    for k, (anno, calm) in enumerate(zip(titles, calms)):
+        calm_text = str(int(round(calm * 100))) + "%"
+        if calm > 0.2:
+            # If there's enough room, add the "calm" text fragment
+            calm_text += " calm"
+        calm_annotations.append(
+            {
+                **anno,
+                "y": anno["y"] - calm_offset,
+                "font": {"color": "#000", "size": 10},
+                "text": calm_text,
+            }
         )
-        traces.append(go.Barpolar(props))
 
-    # Compute the maximum extent of any particular
-    # petal on the wind rose.
-    frequencies = pd.DataFrame(d, columns=["frequency", "direction_class"])
-    max_petal = frequencies.groupby(["direction_class"]).sum().max()
-    return max_petal
+        polar = "polar" + (str(k + 1) if k > 0 else "")
+        layout[polar] = {
+            **grid_layout[polar],
+            "radialaxis": {
+                **grid_layout[polar]["radialaxis"],
+                "range": [0, rmaxf],
+                "dtick": rstep,
+            },
+            "hole": calm,
+        }
+    layout["annotations"] = titles + calm_annotations
 
+    return {"data": traces, "layout": layout}
 
-@app.callback(Output("means_box", "figure"), [Input("communities-dropdown", "value")])
-def update_box_plots(community):
+
+@cache.memoize
+def update_box_plots(community, c_name):
     """Generate box plot for monthly averages"""
 
-    d = monthly_means.loc[(monthly_means["sid"] == community)]
-    c_name = luts.communities.loc[community]["place"]
+    d = monthly_means[community]
 
     return go.Figure(
         layout=dict(
@@ -263,22 +344,20 @@ def update_box_plots(community):
     )
 
 
-@app.callback(Output("rose", "figure"), [Input("communities-dropdown", "value")])
-def update_rose(community):
+@cache.memoize
+def update_rose(community, c_name):
     """Generate cumulative wind rose for selected community"""
     traces = []
 
     # Subset for community & 0=year
-    d = data.loc[(data["sid"] == community) & (data["month"] == 0)]
-    get_rose_traces(d, traces, "", True)
+    d = data[(community, 0)]
+    get_rose_traces(d, traces, showlegend=True)
 
     # Compute % calm, use this to modify the hole size
-    c = calms[calms["sid"] == community]
+    c = calms[community]
     c_mean = c.mean(numeric_only=True)
     c_mean = int(round(c_mean["percent"]))
 
-    c_name = luts.communities.loc[community]["place"]
-
     rose_layout = {
         "title": dict(
             text="Annual Wind Speed/Direction Distribution, 1980-2014, " + c_name,
@@ -331,191 +410,76 @@ def update_rose(community):
     return {"layout": rose_layout, "data": traces}
 
 
-@app.callback(
-    Output("rose_monthly", "figure"), [Input("communities-dropdown", "value")]
+monthly_rose_layout = get_rose_grid_layout(
+    4,
+    3,
+    list(luts.months.values()),
+    0.01,
+    vertical_spacing=0.04,
+    margin=dict(l=0, t=100, r=0, b=0),
+    height=1500,
 )
-def update_rose_monthly(community):
+
+
+@cache.memoize
+def update_rose_monthly(community, c_name):
     """
     Create a grid of subplots for all wind roses.
     """
 
-    # t = top margin in % of figure.
-    subplot_spec = dict(type="polar", t=0.01)
-    fig = make_subplots(
-        rows=4,
-        cols=3,
-        horizontal_spacing=0.03,
-        vertical_spacing=0.04,
-        specs=[
-            [subplot_spec, subplot_spec, subplot_spec],
-            [subplot_spec, subplot_spec, subplot_spec],
-            [subplot_spec, subplot_spec, subplot_spec],
-            [subplot_spec, subplot_spec, subplot_spec],
-        ],
-        subplot_titles=list(luts.months.values()),
-    )
-
-    max_axes = pd.DataFrame()
-    month = 1
-    for i in range(1, 5):
-        for j in range(1, 4):
-            if_show_legend = month == 1  # only show the first legend
-            traces = []
-            d = data.loc[(data["sid"] == community) & (data["month"] == month)]
-            max_axes = pd.concat(
-                [max_axes, get_rose_traces(d, traces, month, if_show_legend)],
-                ignore_index=True,
-            )
-            for trace in traces:
-                fig.add_trace(trace, row=i, col=j)
-            month += 1
-
-    # Determine maximum r-axis and r-step.
-    # Adding one and using floor(/2.5) was the
-    # result of experimenting with values that yielded
-    # about 3 steps in most cases, with a little headroom
-    # for the r-axis outer ring.
-    rmax = max_axes.max()
-    rmaxf = rmax.iloc[0] + 1
-    rstep = math.floor(rmaxf / 2.5)
-
-    # Apply formatting to subplot titles,
-    # which are actually annotations.
-    for i in fig["layout"]["annotations"]:
-        i["y"] = i["y"] + 0.01
-        i["font"] = dict(size=12, color="#444")
-        i["text"] = "<b>" + i["text"] + "</b>"
-
-    c_name = luts.communities.loc[community]["place"]
-
-    # Generate calms.  Subset by community, re-index
-    # for easy access, preprocess percent hole size,
-    # drop unused columns.
-    c = calms[calms["sid"] == community]
-    c = c.reset_index()
-    c = c.assign(percent=c["percent"] / 100)
-
-    # Get calms as annotations, then merge
-    # them into the subgraph title annotations
-    fig["layout"]["annotations"] = fig["layout"][
-        "annotations"
-    ] + get_rose_calm_month_annotations(fig["layout"]["annotations"], c)
-
-    polar_props = dict(
-        bgcolor="#fff",
-        angularaxis=dict(
-            tickmode="array",
-            tickvals=[0, 45, 90, 135, 180, 225, 270, 315],
-            ticktext=["N", "NE", "E", "SE", "S", "SW", "W", "NW"],
-            tickfont=dict(color="#444", size=10),
-            showticksuffix="last",
-            showline=False,  # no boundary circles
-            color="#888",  # set most colors to #888
-            gridcolor="#efefef",
-            rotation=90,  # align compass to north
-            direction="clockwise",  # degrees go clockwise
-        ),
-        radialaxis=dict(
-            color="#888",
-            gridcolor="#efefef",
-            tickangle=0,
-            range=[0, rmaxf],
-            tick0=1,
-            dtick=rstep,
-            ticksuffix="%",
-            showticksuffix="last",
-            showline=False,  # hide the dark axis line
-            tickfont=dict(color="#444"),
-        ),
-    )
-    fig.update_layout(
-        title=dict(
-            text="Monthly Wind Speed/Direction Distribution, 1980-2014, " + c_name,
-            font=dict(family="Open Sans", size=18),
-            x=0.5,
-        ),
-        margin=dict(l=0, t=100, r=0, b=0),
-        font=dict(family="Open Sans", size=10),
-        legend=dict(x=0, y=0, orientation="h"),
-        height=1500,
-        paper_bgcolor="#fff",
-        plot_bgcolor="#fff",
-        # We need to explicitly define the rotations
-        # we need for each named subplot.
-        # TODO is there a more elegant way to
-        # generate this list of things?
-        polar1={**polar_props, **{"hole": c.iloc[0]["percent"]}},
-        polar2={**polar_props, **{"hole": c.iloc[1]["percent"]}},
-        polar3={**polar_props, **{"hole": c.iloc[2]["percent"]}},
-        polar4={**polar_props, **{"hole": c.iloc[3]["percent"]}},
-        polar5={**polar_props, **{"hole": c.iloc[4]["percent"]}},
-        polar6={**polar_props, **{"hole": c.iloc[5]["percent"]}},
-        polar7={**polar_props, **{"hole": c.iloc[6]["percent"]}},
-        polar8={**polar_props, **{"hole": c.iloc[7]["percent"]}},
-        polar9={**polar_props, **{"hole": c.iloc[8]["percent"]}},
-        polar10={**polar_props, **{"hole": c.iloc[9]["percent"]}},
-        polar11={**polar_props, **{"hole": c.iloc[10]["percent"]}},
-        polar12={**polar_props, **{"hole": c.iloc[11]["percent"]}},
+    # Subplots are named polar, polar2, ... polar12, row by row.
+    traces = []
+    max_axes = []
+    for month in range(1, 13):
+        if_show_legend = month == 1  # only show the first legend
+        subplot = "polar" if month == 1 else "polar" + str(month)
+        d = data[(community, month)]
+        max_axes.append(get_rose_traces(d, traces, subplot, if_show_legend))
+
+    # Calms, as a fraction, by month.
+    c = calms[community]
+    month_calms = (c["percent"] / 100).tolist()
+
+    return get_rose_grid_figure(
+        monthly_rose_layout,
+        traces,
+        "Monthly Wind Speed/Direction Distribution, 1980-2014, " + c_name,
+        max_axes,
+        month_calms,
+        0.1225,
     )
-    return fig
 
 
-@app.callback(
-    Output("threshold_graph", "figure"),
-    [
-        Input("communities-dropdown", "value"),
-        Input("duration-dropdown", "value"),
-        Input("gcm-dropdown", "value"),
-    ],
-)
-def update_threshold_graph(community, duration, gcm):
+@cache.memoize
+def update_threshold_graph(community, c_name, duration, gcm):
     """
     Build chart / visualiztion of threshold/durations
     from model data.
     """
 
-    c_name = luts.communities.loc[community]["place"]
-
-    # Filter by community and selected models.
-    # Don't filter by duration, here, because it
-    # could result in incomplete list of possible
-    # speed buckets.
-    dk = percentiles.loc[
-        (percentiles["stid"] == community)
-        & ((percentiles["gcm"] == gcm) | (percentiles["gcm"] == "ERA"))
-    ]
+    # Events by percentile and decade, with ERA-Interim's
+    # decades included, and the wind speed of each percentile
+    # (see preprocess.py).
+    events = threshold["events"][(community, gcm, duration)]
+    speeds = threshold["speeds"][(community, gcm)]
+    percentile_labels = threshold["events"].labels[3]
+    decades = threshold["events"].labels[4]
 
     traces = []
-    index = 0
-
-    # Determine wind speed buckets (needs all available data)
-    wind_speeds = dk.ws_thr.unique()
-
-    # PADT (Slana) has an exception where the 85th/95th percentiles
-    # are idential (!).  Handle that here.
-    percentile_lookups = luts.percentiles
-    if community == "PADT":
-        percentile_lookups = np.delete(percentile_lookups, [3])
-
-    labels = np.char.add(wind_speeds.astype("U"), percentile_lookups)
-
-    # Filter by duration class
-    dk = dk.loc[percentiles["dur_thr"] == duration]
-
-    for ws in dk.ws_thr.unique():
-        # Need to filter, glue together the 2000's (between ERA/GCM)
-        k = dk.loc[dk.ws_thr == ws].groupby(["ts"]).sum().reset_index()
+    for index, percentile in enumerate(percentile_labels):
+        present = ~np.isnan(events[index])
+        if not present.any():
+            continue
         traces.append(
             go.Bar(
-                name=labels[index],
-                x=k.ts,
-                y=k.events,
+                name=str(speeds[index]) + luts.percentiles[percentile],
+                x=decades[present],
+                y=events[index][present].astype("int"),
                 width=10,
-                marker=dict(color=luts.colors[index], line=dict(width=0)),
+                marker=dict(color=luts.colors[percentile], line=dict(width=0)),
                 hovertemplate="%{y} events<extra></extra>",
             )
         )
-        index += 1
 
     return go.Figure(
         layout=dict(
@@ -545,98 +509,18 @@ def update_threshold_graph(community, duration, gcm):
     )
 
 
-@app.callback(
-    Output("future_delta_percentiles", "figure"),
-    [
-        Input("communities-dropdown", "value"),
-        Input("gcm-dropdown", "value"),
-        Input("decadal_selector", "value"),
-    ],
-)
-def update_future_delta_percentiles(community, gcm, decade):
+@cache.memoize
+def update_future_delta_percentiles(community, c_name, gcm, decade):
     """
     Build visualization that shows the number
     of events, categorized by wind speed (y-axis)
     and duration (x-axis).
     """
 
-    c_name = luts.communities.loc[community]["place"]
-
     fig = go.Figure()
 
-    # Filter by community & relevant models
-    dt = percentiles.loc[(percentiles["stid"] == community)]
-    dt = dt.groupby(["gcm", "ts", "ws_thr", "dur_thr"]).sum().reset_index()
-
-    de = dt.loc[(dt.gcm == "ERA") & (dt.ts == 1980)]
-    dc = dt.loc[(dt.gcm == gcm) & (dt.ts == decade)]
-
-    dec = de.set_index(["ws_thr", "dur_thr"])
-    dcc = dc.set_index(["ws_thr", "dur_thr"])
-
-    # Merge the two dataframes (outer join)
-    # Outer join ensures wind events present in either
-    # dataframe are included (union)
-    dj = dcc.join(dec, how="outer", lsuffix="_model", rsuffix="_ERA")
-    dj = dj.fillna(0)  # so we can subtract
-    dj["delta"] = dj["events_model"] - dj["events_ERA"]
-    dj = dj.reset_index()
-
-    # Compute % change between baseline and model
-    # Handle NaN and NA values, then round to integer.
-    dj["percent_change"] = (dj["delta"] / dj["events_ERA"]) * 100
-    dj["percent_change"] = (
-        dj["percent_change"].replace([np.inf], 0).fillna(0).round(0).astype("int")
-    )
-
-    # Group magnitude of changes into 5 quantiles
-    dj["bins"] = pd.qcut(dj["delta"].abs(), 5)
-    dj["bin_labels"] = pd.qcut(
-        dj["delta"].abs(), 5, labels=["least", "some", "middle", "more", "most"]
-    )
-
-    # Take absolute value to show magnitude, since
-    # now color shows +/-.  "inf" values are possible due
-    # to new events; replace them with the mean.
-    # nan are also possible (0/0)
-    dj["marker_size"] = dj["bin_labels"].apply(lambda label: luts.bubble_bins[label])
-
-    # Format hover text nicely.
-    def build_hover_text(row):
-        if int(row["delta"]) == 0:
-            return "No change"
-
-        if int(row["events_ERA"]) != 0:
-            t = "<b>" + str(row["percent_change"]) + "% "
-            if int(row["delta"]) > 0:
-                t += "more</b> events,<br>"
-            else:
-                t += "fewer</b> events,<br>"
-        else:
-            t = "<b>" + str(int(row["delta"])) + " new events</b>,<br>"
-
-        t += str(row["ws_thr"]) + "mph<br>"
-        t += luts.durations[row["dur_thr"]]
-        return t
-
-    dj["hover_text"] = dj.apply(build_hover_text, axis=1)
-
-    # Annotations show changed number of events.
-    def build_annotation_text(row):
-        # Add a + sign if the row is positive, and format
-        # the numbers nicely.
-        sign = "+" if row["delta"] > 0 else ""
-        return "<b>" + sign + f'{int(row["delta"]):,}' + "</b>"
-
-    dj["annotations"] = dj.apply(build_annotation_text, axis=1)
-
-    def build_annotation_positions(row):
-        # Magic number 20 = trial and error for the
-        # threshold at which the bubbles _generally_ look
-        # better with the text annotation to the right.
-        return "middle center" if row["marker_size"] > 20 else "middle right"
-
-    dj["annotations_positions"] = dj.apply(build_annotation_positions, axis=1)
+    # Changes in events by threshold, computed in preprocess.py.
+    dj = deltas[(community, gcm, decade)]
 
     # Build the trace for increased frequency events.
     inc_freq_df = dj.loc[dj.delta > 0]
@@ -696,16 +580,10 @@ def update_future_delta_percentiles(community, gcm, decade):
         + c_name
     )
 
-    # We need to specially handle Slana (PADT).
-    ytickvals = dj["ws_thr"].unique().astype("U")
-
-    # PADT (Slana) has an exception where the 85th/95th percentiles
-    # are idential (!).  Handle that here.
-    percentile_lookups = luts.percentiles
-    if community == "PADT":
-        percentile_lookups = np.delete(percentile_lookups, [3])
-
-    yticktext = np.char.add(ytickvals, percentile_lookups)
+    # Label each threshold with its percentile (see preprocess.py).
+    yticks = dj[["ws_thr", "percentile"]].drop_duplicates()
+    ytickvals = yticks["ws_thr"].to_numpy().astype("U")
+    yticktext = np.char.add(ytickvals, luts.percentiles[yticks["percentile"]])
 
     fig.update_layout(
         title=dict(text=figure_text, x=0.5, font=dict(size=18)),
@@ -730,167 +608,117 @@ def update_future_delta_percentiles(community, gcm, decade):
     return fig
 
 
-def get_rose_calm_future_annotations(titles, calm):
-    """
-    Return a list of correctly-positioned %calm indicators
-    for the monthly wind rose charts.
-    Take the already-generated list of titles and use
-    that pixel geometry to position the %calm info.
-    """
-    calm_annotations = copy.deepcopy(titles)
-
-    k = 0
-    for anno in calm_annotations:
-        anno["y"] = anno["y"] - 0.56
-        anno["font"] = {"color": "#000", "size": 10}
-        calm_text = str(int(round(calm[k] * 100))) + "%"
-        if calm[k] > 0.2:
-            # If there's enough room, add the "calm" text fragment
-            calm_text += " calm"
-
-        anno["text"] = calm_text
-        k += 1
-
-    return calm_annotations
-
-
-@app.callback(
-    Output("future_rose", "figure"),
-    [Input("communities-dropdown", "value"), Input("gcm-dropdown", "value")],
-)
-def update_future_rose(community, gcm):
-    """Generate cumulative future wind rose for selected community
-    this is very rough right now.
-    """
-
-    # t = top margin in % of figure.
-    subplot_spec = dict(type="polar", t=0.01)
-    fig = make_subplots(
-        rows=1,
-        cols=3,
-        horizontal_spacing=0.03,
-        specs=[[subplot_spec, subplot_spec, subplot_spec]],
-        subplot_titles=[
+future_rose_layouts = {
+    gcm: get_rose_grid_layout(
+        1,
+        3,
+        [
             "ERA-Interim (1980-2009)",
             luts.gcms[gcm] + " (2025-2054)",
             luts.gcms[gcm] + " (2070-2099)",
         ],
+        0.04,
+        margin=dict(l=0, t=75, r=0, b=0),
+        height=550,
     )
+    for gcm in luts.gcms
+}
+
+
+@cache.memoize
+def update_future_rose(community, c_name, gcm):
+    """Generate cumulative future wind rose for selected community
+    this is very rough right now.
+    """
 
-    max_axes = pd.DataFrame()
+    max_axes = []
+    traces = []
 
     # ERA
     future_calms = {}
-    traces = []
-    d = future_rose.loc[
-        (future_rose["sid"] == community) & (future_rose["gcm"] == "ERA")
-    ]
+    d = future_rose[(community, "ERA", 0)]
     future_calms["ERA"] = round(100 - d["frequency"].sum(), 1) / 100
-    max_axes = pd.concat(
-        [max_axes, get_rose_traces(d, traces, "", True)], ignore_index=True
-    )
-    for trace in traces:
-        fig.add_trace(trace, row=1, col=1)
+    max_axes.append(get_rose_traces(d, traces, "polar", True))
 
     # GCM -- 1st decadal group
-    traces = []
-    d = future_rose.loc[
-        (future_rose["sid"] == community)
-        & (future_rose["gcm"] == gcm)
-        & (future_rose["decadal_group"] == 1)
-    ]
+    d = future_rose[(community, gcm, 1)]
     future_calms["GCM1"] = round(100 - d["frequency"].sum(), 1) / 100
-    max_axes = pd.concat(
-        [max_axes, get_rose_traces(d, traces, "", False)], ignore_index=True
-    )
-    for trace in traces:
-        fig.add_trace(trace, row=1, col=2)
+    max_axes.append(get_rose_traces(d, traces, "polar2", False))
 
     # GCM -- 2nd decadal group
-    traces = []
-    d = future_rose.loc[
-        (future_rose["sid"] == community)
-        & (future_rose["gcm"] == gcm)
-        & (future_rose["decadal_group"] == 2)
-    ]
+    d = future_rose[(community, gcm, 2)]
     future_calms["GCM2"] = round(100 - d["frequency"].sum(), 1) / 100
-    max_axes = pd.concat(
-        [max_axes, get_rose_traces(d, traces, "", False)], ignore_index=True
+    max_axes.append(get_rose_traces(d, traces, "polar3", False))
+
+    return get_rose_grid_figure(
+        future_rose_layouts[gcm],
+        traces,
+        "Modeled Wind Speed/Direction Distribution, 1980-2099, " + c_name,
+        max_axes,
+        list(future_calms.values()),
+        0.56,
     )
-    for trace in traces:
-        fig.add_trace(trace, row=1, col=3)
-    # Determine maximum r-axis and r-step.
-    # Adding one and using floor(/2.5) was the
-    # result of experimenting with values that yielded
-    # about 3 steps in most cases, with a little headroom
-    # for the r-axis outer ring.
-    rmax = max_axes.max()
-    rmaxf = rmax.iloc[0] + 1
-    rstep = math.floor(rmaxf / 2.5)
 
-    # Apply formatting to subplot titles,
-    # which are actually annotations.
-    for i in fig["layout"]["annotations"]:
-        i["y"] = i["y"] + 0.04
-        i["font"] = dict(size=12, color="#444")
-        i["text"] = "<b>" + i["text"] + "</b>"
 
-    c_name = luts.communities.loc[community]["place"]
+# Everything shown for a community: the output, the function
+# building it and the inputs it takes after the community.
+community_outputs = [
+    (Output("means_box", "figure"), update_box_plots, []),
+    (Output("rose", "figure"), update_rose, []),
+    (Output("rose_monthly", "figure"), update_rose_monthly, []),
+    (
+        Output("threshold_graph", "figure"),
+        update_threshold_graph,
+        ["duration-dropdown", "gcm-dropdown"],
+    ),
+    (
+        Output("future_delta_percentiles", "figure"),
+        update_future_delta_percentiles,
+        ["gcm-dropdown", "decadal_selector"],
+    ),
+    (Output("future_rose", "figure"), update_future_rose, ["gcm-dropdown"]),
+]
+community_inputs = [
+    "communities-dropdown",
+    "duration-dropdown",
+    "gcm-dropdown",
+    "decadal_selector",
+]
 
-    # Get calms as annotations, then merge
-    # them into the subgraph title annotations
-    fig["layout"]["annotations"] = fig["layout"][
-        "annotations"
-    ] + get_rose_calm_future_annotations(
-        fig["layout"]["annotations"], list(future_calms.values())
-    )
 
-    polar_props = dict(
-        bgcolor="#fff",
-        angularaxis=dict(
-            tickmode="array",
-            tickvals=[0, 45, 90, 135, 180, 225, 270, 315],
-            ticktext=["N", "NE", "E", "SE", "S", "SW", "W", "NW"],
-            tickfont=dict(color="#444", size=10),
-            showticksuffix="last",
-            showline=False,  # no boundary circles
-            color="#888",  # set most colors to #888
-            gridcolor="#efefef",
-            rotation=90,  # align compass to north
-            direction="clockwise",  # degrees go clockwise
-        ),
-        radialaxis=dict(
-            color="#888",
-            gridcolor="#efefef",
-            tickangle=0,
-            range=[0, rmaxf],
-            tick0=1,
-            dtick=rstep,
-            ticksuffix="%",
-            showticksuffix="last",
-            showline=False,  # hide the dark axis line
-            tickfont=dict(color="#444"),
-        ),
-    )
-    fig.update_layout(
-        title=dict(
-            text="Modeled Wind Speed/Direction Distribution, 1980-2099, " + c_name,
-            font=dict(family="Open Sans", size=18),
-            x=0.5,
-        ),
-        margin=dict(l=0, t=75, r=0, b=0),
-        font=dict(family="Open Sans", size=10),
-        legend=dict(x=0, y=0, orientation="h"),
-        height=550,
-        paper_bgcolor="#fff",
-        plot_bgcolor="#fff",
-        # We need to explicitly define the rotations
-        # we need for each named subplot.
-        polar1={**polar_props, **{"hole": future_calms["ERA"]}},
-        polar2={**polar_props, **{"hole": future_calms["GCM1"]}},
-        polar3={**polar_props, **{"hole": future_calms["GCM2"]}},
-    )
-    return fig
+@app.callback(
+    [output for output, _, _ in community_outputs],
+    [Input(component, "value") for component in community_inputs],
+)
+def update_community(*values):
+    """
+    Update everything shown for a community in one request.
+    Only the outputs depending on the input(s) which changed
+    are rebuilt, the others are left as they are.
+    """
+    values = dict(zip(community_inputs, values))
+    community = values["communities-dropdown"]
+
+    # Looked up once here and passed to every figure.
+    c_name = luts.communities.loc[community]["place"]
+
+    # Empty on the initial call, when everything is built.
+    triggered = set(dash.callback_context.triggered_prop_ids.values())
+
+    results = []
+    for output, fn, inputs in community_outputs:
+        if triggered and triggered.isdisjoint(["communities-dropdown"] + inputs):
+            results.append(dash.no_update)
+            continue
+        try:
+            results.append(
+                fn(community, c_name, *[values[component] for component in inputs])
+            )
+        except Exception:  # pylint: disable=broad-except
+            # Don't let one failing figure block all the others.
+            app.logger.exception("Failed to update " + str(output))
+            results.append(dash.no_update)
+    return results
 
 
 if __name__ == "__main__":
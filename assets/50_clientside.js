@@ -0,0 +1,53 @@
+/*
+ * Clientside callbacks, which only need the lookup tables
+ * in the "client-data" store and so don't need a request.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    cw: {
+        // Draw a second trace on the map with one community highlighted.
+        highlightCommunity: function (community, figure, data) {
+            var place = data.places[community];
+            if (!place) {
+                return window.dash_clientside.no_update;
+            }
+            return {
+                data: [
+                    figure.data[0],
+                    {
+                        type: "scattermapbox",
+                        lat: [place.latitude],
+                        lon: [place.longitude],
+                        mode: "markers",
+                        marker: { size: 20, color: "rgb(207, 38, 47)" },
+                        line: { color: "rgb(0, 0, 0)", width: 2 },
+                        text: place.place,
+                        hoverinfo: "text",
+                    },
+                ],
+                layout: figure.layout,
+            };
+        },
+
+        // Name the chart downloads after the community, with the
+        // options in data.exports for each chart (output).
+        updateExportFilenames: function (community, data) {
+            var place = data.places[community];
+            var outputs = window.dash_clientside.callback_context.outputs_list;
+            return outputs.map(function (output) {
+                if (!place) {
+                    return window.dash_clientside.no_update;
+                }
+                var options = Object.assign(
+                    {},
+                    data.config.toImageButtonOptions,
+                    data.exports[output.id]
+                );
+                options.filename = place.place + " " + options.title;
+                delete options.title;
+                return Object.assign({}, data.config, {
+                    toImageButtonOptions: options,
+                });
+            });
+        },
+    },
+});
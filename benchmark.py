@@ -0,0 +1,325 @@
+"""
+
+Benchmarks for the preprocessing pipeline (preprocess.py).
+
+Generates synthetic IEM-shaped station files, WRF-shaped
+CCSM4_/CM3_ files and a WRF_hwe_perc.csv in a scratch
+directory, runs each preprocessing stage there and reports
+rows/second and peak (Python-allocated) memory per stage.
+
+Outputs can be saved as a reference and compared against
+later runs, to prove an optimized stage still produces
+identical roses, calms, etc.:
+
+    python benchmark.py --save-reference ref/
+    ... change preprocess.py ...
+    python benchmark.py --reference ref/
+
+"""
+
+# pylint: disable=invalid-name, import-outside-toplevel
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# Outputs compared against a reference run.
+outputs = [
+    "roses.csv",
+    "calms.csv",
+    "monthly_averages.csv",
+    "future_roses.csv",
+    "percentiles.csv",
+    "delta_percentiles.csv",
+    "threshold_events.csv",
+]
+
+
+def generate_places(count):
+    """Synthetic places.csv with `count` stations."""
+    sids = ["P" + chr(65 + i // 26 % 26) + chr(65 + i % 26) + "X" for i in range(count)]
+    return pd.DataFrame(
+        {
+            "sid": sids,
+            "place": ["Place " + sid for sid in sids],
+            "latitude": np.linspace(55, 70, count),
+            "longitude": np.linspace(-165, -140, count),
+        }
+    )
+
+
+def winds(rng, count):
+    """Random (direction, speed) with calms and round numbers."""
+    direction = rng.integers(0, 36, count) * 10.0
+    speed = np.round(rng.gamma(2, 4, count))
+    speed[rng.random(count) < 0.15] = 0
+    return direction, speed
+
+
+def generate_stations(rng, places, years):
+    """
+    Write one hourly IEM-style file per place to data/station,
+    ending in 2014.  Returns the number of rows written.
+    """
+    os.makedirs("data/station", exist_ok=True)
+    ts = pd.date_range(str(2015 - years), "2014-12-31 23:00", freq="h")
+    stamps = ts.strftime("%Y-%m-%d %H:%M")
+    for sid in places["sid"]:
+        direction, speed = winds(rng, len(ts))
+        direction[rng.random(len(ts)) < 0.01] = np.nan
+        pd.DataFrame(
+            {
+                "station": sid,
+                "t_round": stamps,
+                "drct": direction,
+                "sped": speed * 1.15,
+                "sped_adj": speed,
+                "t_actual": stamps,
+            }
+        ).to_csv(os.path.join("data/station", sid + ".csv"), index=False)
+    return len(ts) * len(places.index)
+
+
+def generate_wrf(rng, places, step):
+    """
+    Write CCSM4_/CM3_ files for every place to data/wrf_adj,
+    with a reading every `step` hours: ERA-Interim 1980-2015
+    in the CCSM4 file, and the model 2006-2099 in both files.
+    Returns the number of rows written.
+    """
+    os.makedirs("data/wrf_adj", exist_ok=True)
+    freq = str(step) + "h"
+    periods = {
+        "ERA": pd.date_range("1980", "2015-12-31 23:00", freq=freq),
+        "GCM": pd.date_range("2006", "2099-12-31 23:00", freq=freq),
+    }
+    stamps = {k: v.strftime("%Y-%m-%d %H:%M:%S") for k, v in periods.items()}
+    rows = 0
+    for sid in places["sid"]:
+        for gcm in ["CCSM4", "CM3"]:
+            parts = [("ERA", "ERA")] if gcm == "CCSM4" else []
+            parts.append((gcm, "GCM"))
+            frames = []
+            for group, period in parts:
+                direction, speed = winds(rng, len(stamps[period]))
+                frames.append(
+                    pd.DataFrame(
+                        {
+                            "group": group,
+                            "stid": sid,
+                            "ts": stamps[period],
+                            "ws": speed,
+                            "wd": direction,
+                        }
+                    )
+                )
+            df = pd.concat(frames)
+            df.to_csv(
+                os.path.join("data/wrf_adj", gcm + "_" + sid + ".csv"), index=False
+            )
+            rows += len(df.index)
+    return rows
+
+
+def generate_events(rng, places, count):
+    """
+    Write a WRF_hwe_perc.csv of `count` wind events per place.
+    Returns the number of rows written.
+    """
+    thresholds = np.round(rng.uniform(5, 40, (len(places.index), 5)), 1)
+    thresholds.sort(axis=1)
+    frames = []
+    for i, sid in enumerate(places["sid"]):
+        gcm = rng.choice(["ERA", "CCSM4", "CM3"], count)
+        ts = np.where(
+            gcm == "ERA",
+            rng.choice([1980, 2000], count),
+            rng.choice([2000, 2020, 2040, 2060, 2080], count),
+        )
+        frames.append(
+            pd.DataFrame(
+                {
+                    "stid": sid,
+                    "gcm": gcm,
+                    "ts": ts,
+                    "ws_thr": thresholds[i][rng.integers(0, 5, count)],
+                    "dur_thr": rng.choice([1, 6, 12, 24, 48], count),
+                    "wd": rng.integers(0, 360, count),
+                }
+            )
+        )
+    df = pd.concat(frames)
+    df.to_csv("WRF_hwe_perc.csv", index=False)
+    return len(df.index)
+
+
+def measure(results, stage, rows, fn, *args):
+    """
+    Run `fn(*args)` and record its time and peak memory.
+    """
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - start_memory
+    results.append(
+        {
+            "stage": stage,
+            "rows": rows,
+            "seconds": round(seconds, 3),
+            "rows/s": int(rows / seconds) if seconds > 0 else 0,
+            "peak MB": round(peak / 2**20, 1),
+        }
+    )
+    return result
+
+
+def run(args):
+    """
+    Generate the synthetic inputs and benchmark every stage.
+    Must run with the scratch directory as working directory,
+    since preprocess.py and luts.py use relative paths.
+    """
+    rng = np.random.default_rng(args.seed)
+    places = generate_places(args.places)
+    places.to_csv("places.csv", index=False)
+
+    print("Generating synthetic data...")
+    station_rows = generate_stations(rng, places, args.years)
+    wrf_rows = generate_wrf(rng, places, args.wrf_step)
+    event_rows = generate_events(rng, places, args.events)
+
+    import preprocess
+
+    results = []
+    tracemalloc.start()
+
+    measure(
+        results, "preprocess_stations", station_rows, preprocess.preprocess_stations
+    )
+
+    mean_data = preprocess.read_stations(["sid", "year", "month", "direction", "speed"])
+    stats = measure(
+        results, "monthly_stats", station_rows, preprocess.monthly_stats, mean_data
+    )
+    measure(results, "process_calm", len(stats.index), preprocess.process_calm, stats)
+    measure(
+        results,
+        "averages_by_month",
+        len(stats.index),
+        preprocess.averages_by_month,
+        stats,
+    )
+
+    data = preprocess.read_stations(
+        ["sid", "direction", "speed", "month"], roses=True
+    ).compute()
+    counts = measure(
+        results, "rose_counts", len(data.index), preprocess.rose_counts, data
+    )
+    measure(
+        results,
+        "process_roses",
+        len(counts.index),
+        preprocess.process_roses,
+        counts,
+        stats,
+    )
+
+    # Memory of worker processes isn't traced, use --jobs 1 for it.
+    measure(
+        results,
+        "process_future_roses",
+        wrf_rows,
+        preprocess.process_future_roses,
+        args.jobs,
+    )
+    measure(
+        results,
+        "process_threshold_percentiles",
+        event_rows,
+        preprocess.process_threshold_percentiles,
+    )
+    measure(
+        results,
+        "process_delta_percentiles",
+        event_rows,
+        preprocess.process_delta_percentiles,
+    )
+    measure(
+        results,
+        "process_threshold_events",
+        event_rows,
+        preprocess.process_threshold_events,
+    )
+
+    tracemalloc.stop()
+    return pd.DataFrame(results)
+
+
+def compare(reference):
+    """
+    Compare the outputs in the working directory with those in
+    `reference`.  Returns a list of the files which differ.
+    """
+    differences = []
+    for filename in outputs:
+        expected = pd.read_csv(os.path.join(reference, filename), index_col=0)
+        actual = pd.read_csv(filename, index_col=0)
+        try:
+            pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+        except AssertionError as e:
+            differences.append(filename)
+            print("*** " + filename + " differs from the reference:\n" + str(e))
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark preprocess.py")
+    parser.add_argument("--places", type=int, default=4, help="number of stations")
+    parser.add_argument(
+        "--years", type=int, default=10, help="years of hourly station data"
+    )
+    parser.add_argument(
+        "--wrf-step", type=int, default=6, help="hours between WRF readings"
+    )
+    parser.add_argument(
+        "--events", type=int, default=20000, help="wind events per place"
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="see preprocess.py")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="scratch directory (default: a temp dir)")
+    parser.add_argument("--reference", help="compare outputs against this directory")
+    parser.add_argument("--save-reference", help="copy outputs to this directory")
+    args = parser.parse_args()
+
+    # Resolve paths before moving to the scratch directory.
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    for option in ["reference", "save_reference"]:
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cw-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print("Working in", workdir)
+
+    report = run(args)
+    print(report.to_string(index=False))
+
+    if args.save_reference:
+        os.makedirs(args.save_reference, exist_ok=True)
+        for filename in outputs:
+            shutil.copy(filename, args.save_reference)
+        print("Saved reference outputs to", args.save_reference)
+
+    if args.reference:
+        if compare(args.reference):
+            sys.exit(1)
+        print("All outputs match the reference.")
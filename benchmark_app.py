@@ -0,0 +1,139 @@
+"""
+
+Measures the memory used by the app's gunicorn workers.
+
+Starts gunicorn (with gunicorn.conf.py) for each worker count,
+with and without preloading the app in the master process,
+warms every worker up with a few requests and reports each
+worker's RSS and PSS (resident memory with shared pages split
+between the processes sharing them).  With preloading, the
+per-worker PSS should stay flat, or drop, as workers are added:
+
+    python benchmark_app.py --workers 1 2 4 8
+
+Run from the directory with the data files, on Linux (it reads
+/proc/<pid>/smaps_rollup).
+
+"""
+
+# pylint: disable=invalid-name
+import os
+import sys
+import time
+import argparse
+import subprocess
+import urllib.request
+import pandas as pd
+
+
+def smaps(pid):
+    """Return {field: kB} from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open("/proc/%d/smaps_rollup" % pid) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def children(pid):
+    """Return the pids of the child processes of `pid`."""
+    with open("/proc/%d/task/%d/children" % (pid, pid)) as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_until_up(url, timeout):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            with urllib.request.urlopen(url) as response:
+                response.read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError("Server didn't come up at " + url)
+
+
+def measure(workers, preload, port, requests, timeout):
+    """
+    Start the app with `workers` workers and return one row
+    per worker with its memory use, in MB.
+    """
+    env = dict(os.environ, CW_PRELOAD="1" if preload else "0")
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "--workers",
+            str(workers),
+            "--bind",
+            "127.0.0.1:%d" % port,
+            "application:application",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = "http://127.0.0.1:%d/" % port
+        wait_until_up(url, timeout)
+
+        # Without preloading, workers import the app when they
+        # start: wait until all of them are up.
+        while len(children(server.pid)) < workers:
+            time.sleep(0.5)
+        for _ in range(requests * workers):
+            for path in ["", "_dash-layout", "_dash-dependencies"]:
+                with urllib.request.urlopen(url + path) as response:
+                    response.read()
+
+        rows = []
+        for pid in children(server.pid):
+            memory = smaps(pid)
+            rows.append(
+                {
+                    "workers": workers,
+                    "preload": preload,
+                    "pid": pid,
+                    "rss MB": round(memory["Rss"] / 1024, 1),
+                    "pss MB": round(memory["Pss"] / 1024, 1),
+                    "private MB": round(
+                        (memory["Private_Clean"] + memory["Private_Dirty"]) / 1024, 1
+                    ),
+                }
+            )
+        return rows
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure app worker memory")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--requests", type=int, default=5, help="warm-up requests per worker"
+    )
+    parser.add_argument("--timeout", type=int, default=120, help="startup timeout (s)")
+    args = parser.parse_args()
+
+    results = []
+    for count in args.workers:
+        for mode in [True, False]:
+            results.extend(measure(count, mode, args.port, args.requests, args.timeout))
+    results = pd.DataFrame(results)
+
+    print(results.to_string(index=False))
+    print()
+    print("Mean per worker:")
+    print(
+        results.groupby(["preload", "workers"])[["rss MB", "pss MB", "private MB"]]
+        .mean()
+        .round(1)
+        .to_string()
+    )
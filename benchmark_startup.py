@@ -0,0 +1,140 @@
+"""
+
+Reports where the app spends its startup time.
+
+Imports the app in a fresh Python process (with -X importtime),
+the libraries first and then the app's own modules in the order
+they depend on each other, and reports the time each import
+adds, and how long each dataset took to load and partition
+(which is part of importing application.py).  A listed module
+already imported by an earlier one (e.g. pyarrow by pandas) is
+reported as included in it:
+
+    python benchmark_startup.py
+    python benchmark_startup.py --lazy  # with CW_LAZY_DATA=1
+
+Run from the directory with the data files.
+
+"""
+
+# pylint: disable=invalid-name
+import os
+import sys
+import json
+import argparse
+import subprocess
+import pandas as pd
+
+# Imported in this order, so each one's time doesn't include
+# the ones before it.
+modules = [
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "plotly.graph_objs",
+    "plotly.subplots",
+    "dash",
+    "datasets",
+    "luts",
+    "gui",
+    "cache",
+    "figure_store",
+    "application",
+]
+
+child = """
+import json, time
+start = time.perf_counter()
+{imports}
+import datasets
+print(json.dumps({{
+    "total": time.perf_counter() - start,
+    "load": datasets.load_times,
+    "partition": datasets.partition_times,
+}}))
+""".format(imports="\n".join("import " + module for module in modules))
+
+
+def measure(lazy):
+    """
+    Start the app once, return ({module: seconds}, {module:
+    module it was imported by}, {dataset: (load seconds,
+    partition seconds)}, total seconds).
+    """
+    env = dict(os.environ, CW_LAZY_DATA="1" if lazy else "0")
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__)), env.get("PYTHONPATH", "")]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", child],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Lines are "import time: self [us] | cumulative | name",
+    # with the name indented for nested imports, which are
+    # listed before the top-level import they're part of.
+    imports = {}
+    included = {}
+    nested = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name[1:].startswith(" "):
+            if name.strip() in modules and name.strip() not in included:
+                nested.append(name.strip())
+            continue
+        for module in nested:
+            included[module] = name.strip()
+        nested = []
+        if name.strip() in modules:
+            imports[name.strip()] = int(cumulative) / 1e6
+
+    times = json.loads(result.stdout.strip().splitlines()[-1])
+    datasets = {
+        name: (seconds, times["partition"].get(name, 0))
+        for name, seconds in times["load"].items()
+    }
+    return imports, included, datasets, times["total"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report app startup time")
+    parser.add_argument("--lazy", action="store_true", help="set CW_LAZY_DATA=1")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs, the fastest is reported"
+    )
+    args = parser.parse_args()
+
+    runs = [measure(args.lazy) for _ in range(args.repeat)]
+    imports, included, datasets, total = min(runs, key=lambda run: run[3])
+
+    data_seconds = sum(load + partition for load, partition in datasets.values())
+    report = pd.DataFrame(
+        [
+            {
+                "import": module,
+                "seconds": (
+                    "%.3f" % imports[module]
+                    if module in imports
+                    else "(in %s)" % included.get(module, "an earlier import")
+                ),
+            }
+            for module in modules
+        ]
+    )
+    print(report.to_string(index=False))
+    print("(application includes the %.3fs loading data)" % data_seconds)
+    print()
+    report = pd.DataFrame(
+        [
+            {"dataset": name, "load seconds": load, "partition seconds": partition}
+            for name, (load, partition) in datasets.items()
+        ]
+    )
+    print(report.round(3).to_string(index=False))
+    print()
+    print("Total: %.3fs" % total)
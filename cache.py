@@ -0,0 +1,83 @@
+"""
+
+Bounded memoization for the figure-building callbacks.
+
+Callback inputs come from small, finite domains (community,
+GCM, duration, decade), so the same figures are built over
+and over.  Results are kept in one least-recently-used cache
+shared by all memoized callbacks, keyed on the callback name,
+its arguments and the version of the loaded data.
+
+On a miss, the figure is read from the prebuilt figure store
+(see figure_store.py) if it has it, and only built otherwise.
+
+The cache size is set with the CW_CACHE_SIZE environment
+variable (number of figures, default 1024; 0 disables it).
+
+"""
+
+# pylint: disable=invalid-name
+import os
+import threading
+import functools
+from collections import OrderedDict
+import figure_store
+
+max_size = int(os.getenv("CW_CACHE_SIZE", "1024"))
+
+# Set by the app to the version of the data it loaded, so
+# figures built from other data are never served.
+data_version = None
+
+entries = OrderedDict()
+counters = {}
+lock = threading.Lock()
+
+
+def memoize(fn):
+    """
+    Cache the results of `fn`, which must take hashable
+    arguments and return a result which isn't mutated later.
+    """
+    name = fn.__name__
+    counters[name] = {"hits": 0, "misses": 0}
+
+    @functools.wraps(fn)
+    def wrapper(*args):
+        key = (name, args, data_version)
+        with lock:
+            if key in entries:
+                entries.move_to_end(key)
+                counters[name]["hits"] += 1
+                return entries[key]
+            counters[name]["misses"] += 1
+
+        result = figure_store.get(name, args)
+        if result is None:
+            result = fn(*args)
+
+        if max_size > 0:
+            with lock:
+                entries[key] = result
+                while len(entries) > max_size:
+                    entries.popitem(last=False)
+        return result
+
+    return wrapper
+
+
+def info():
+    """
+    Return the cache size and hit/miss counters per callback.
+    """
+    with lock:
+        return {
+            "size": len(entries),
+            "max_size": max_size,
+            "callbacks": {name: dict(c) for name, c in counters.items()},
+        }
+
+
+def clear():
+    with lock:
+        entries.clear()
@@ -0,0 +1,349 @@
+"""
+
+Loads the data tables used by the app.
+
+Parsing the CSV files on every worker boot is slow, so they
+can be packed into a single binary bundle (a sequence of
+Arrow IPC files plus an index) which is memory-mapped at
+startup instead.  Rebuild it after running preprocess.py:
+
+    python datasets.py
+
+If the bundle is missing, was built by another version of
+this code or from other contents of the CSV files, the CSV
+files are read directly.  Contents are compared by hash, not
+modification time, which a git checkout doesn't preserve.
+
+"""
+
+# pylint: disable=invalid-name
+import os
+import json
+import time
+import struct
+import hashlib
+import functools
+import threading
+import numpy as np
+import pyarrow as pa
+import pandas as pd
+
+bundle_file = "datasets.bundle"
+
+# Bump this when `tables` changes, so stale bundles are ignored.
+bundle_version = 5
+
+# Name -> CSV file and the column types it's read with.  Only
+# these columns are read, which skips the unnamed index columns
+# the CSVs are written with.  Strings are categoricals and
+# integers as narrow as they can be.  Floats stay float64:
+# they're shown as-is in hover text and tick labels, where
+# float32 would turn 1.1 into 1.100000023841858.
+tables = {
+    "places": (
+        "places.csv",
+        {"sid": "str", "place": "str", "latitude": "float64", "longitude": "float64"},
+    ),
+    "roses": (
+        "roses.csv",
+        {
+            "sid": "category",
+            "direction_class": "int16",
+            "speed_range": "category",
+            "count": "int32",
+            "frequency": "float64",
+            "month": "int8",
+        },
+    ),
+    "calms": (
+        "calms.csv",
+        {
+            "sid": "category",
+            "month": "int8",
+            "total": "int32",
+            "calm": "int32",
+            "percent": "float64",
+        },
+    ),
+    "monthly_averages": (
+        "monthly_averages.csv",
+        {"sid": "category", "year": "int16", "month": "int8", "speed": "float64"},
+    ),
+    "future_roses": (
+        "future_roses.csv",
+        {
+            "sid": "category",
+            "gcm": "category",
+            "decadal_group": "int8",
+            "direction_class": "int16",
+            "speed_range": "category",
+            "count": "int32",
+            "frequency": "float64",
+        },
+    ),
+    "threshold_events": (
+        "threshold_events.csv",
+        {
+            "stid": "category",
+            "gcm": "category",
+            "dur_thr": "int8",
+            "percentile": "int8",
+            "ts": "int16",
+            "events": "int32",
+            "ws_thr": "float64",
+        },
+    ),
+    "delta_percentiles": (
+        "delta_percentiles.csv",
+        {
+            "stid": "category",
+            "gcm": "category",
+            "decade": "int16",
+            "ws_thr": "float64",
+            "dur_thr": "int8",
+            "events_model": "int32",
+            "events_ERA": "int32",
+            "delta": "int32",
+            "percent_change": "int32",
+            "marker_size": "int8",
+            "hover_text": "category",
+            "annotations": "category",
+            "annotations_positions": "category",
+            "percentile": "int8",
+        },
+    ),
+}
+
+# Tables indexed by one of their columns.
+index_columns = {"places": "sid"}
+
+# The bundle ends with its JSON index and the index length.
+footer = struct.Struct("<Q")
+
+# Name -> seconds it took to load / partition, for the
+# startup report.
+load_times = {}
+partition_times = {}
+
+
+def read_csv(name):
+    """Read one table from its CSV file."""
+    filename, dtypes = tables[name]
+    df = pd.read_csv(filename, usecols=list(dtypes), dtype=dtypes)
+    if name in index_columns:
+        df = df.set_index(index_columns[name])
+    return df
+
+
+def report(loaded):
+    """
+    Print the memory footprint of each loaded table, next to
+    what it takes when read from CSV with default types.
+    """
+    print("table                    rows   compact MB   default MB")
+    for name, df in loaded.items():
+        default = pd.read_csv(tables[name][0])
+        print(
+            "%-20s %8d %12.2f %12.2f"
+            % (
+                name,
+                len(df.index),
+                df.memory_usage(deep=True).sum() / 2**20,
+                default.memory_usage(deep=True).sum() / 2**20,
+            )
+        )
+
+
+def build_bundle():
+    """
+    Write every table to `bundle_file`: each one as an
+    Arrow IPC file, followed by a JSON index of where they
+    are and the version / sources they were built from.
+    """
+    index = {"version": bundle_version, "tables": {}, "sources": {}}
+    with open(bundle_file, "wb") as f:
+        for name, (filename, _) in tables.items():
+            table = pa.Table.from_pandas(read_csv(name))
+            start = f.tell()
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+            index["tables"][name] = [start, f.tell() - start]
+            index["sources"][name] = source_hash(filename)
+        index = json.dumps(index).encode()
+        f.write(index)
+        f.write(footer.pack(len(index)))
+    bundle_index.cache_clear()
+
+
+def source_hash(filename):
+    """Return the SHA-256 of a CSV file's contents."""
+    with open(filename, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def bundle_index():
+    """
+    Return the bundle's index, or None if the bundle
+    can't be used.  It's read once per process.
+    """
+    if not os.path.exists(bundle_file):
+        return None
+    with open(bundle_file, "rb") as f:
+        f.seek(-footer.size, os.SEEK_END)
+        (length,) = footer.unpack(f.read(footer.size))
+        f.seek(-footer.size - length, os.SEEK_END)
+        index = json.loads(f.read(length))
+
+    if index["version"] != bundle_version:
+        print("Ignoring " + bundle_file + ", it's from another version")
+        return None
+    for name, (filename, _) in tables.items():
+        if os.path.exists(filename) and source_hash(filename) != index["sources"][name]:
+            print("Ignoring " + bundle_file + ", " + filename + " has changed")
+            return None
+    return index
+
+
+def data_version():
+    """
+    Identify the data the app loads: the bundle version and
+    the content hashes of the CSV files, the same whether
+    they're loaded from the bundle or read directly.
+    """
+    index = bundle_index()
+    if index is not None:
+        sources = index["sources"]
+    else:
+        sources = {
+            name: source_hash(filename) for name, (filename, _) in tables.items()
+        }
+    return json.dumps([bundle_version, sources], sort_keys=True)
+
+
+def load(names):
+    """
+    Return {name: DataFrame} for the `names` tables, from the
+    memory-mapped bundle if possible, otherwise the CSVs.
+    """
+    index = bundle_index()
+    if index is not None:
+        buffer = pa.memory_map(bundle_file).read_buffer()
+    loaded = {}
+    for name in names:
+        start = time.perf_counter()
+        if index is None:
+            loaded[name] = read_csv(name)
+        else:
+            offset, length = index["tables"][name]
+            reader = pa.ipc.open_file(buffer.slice(offset, length))
+            loaded[name] = reader.read_all().to_pandas()
+        load_times[name] = time.perf_counter() - start
+    return loaded
+
+
+class Partitions(dict):
+    """
+    A table split once into {key: rows} by the `keys`
+    column(s), so lookups are dict accesses rather than
+    scans of the whole table.  Rows keep their order, and
+    missing keys give an empty frame.
+    """
+
+    def __init__(self, df, keys):
+        super().__init__(iter(df.groupby(keys, sort=False, observed=True)))
+        self.empty = df.iloc[:0]
+
+    def __missing__(self, key):
+        return self.empty
+
+
+class Pivot:
+    """
+    The `values` column of a table as a dense array with one
+    axis per `axes` column, NaN where the table has no row, so
+    lookups are array indexing.  Index it with labels of the
+    leading axes, e.g. pivot[(sid, gcm)]; `labels` has the
+    labels of every axis, in order.
+    """
+
+    def __init__(self, df, axes, values):
+        codes = []
+        self.labels = []
+        for axis in axes:
+            axis_codes, labels = pd.factorize(df[axis], sort=True)
+            codes.append(axis_codes)
+            self.labels.append(np.asarray(labels))
+        self.positions = [
+            {label: i for i, label in enumerate(labels)} for labels in self.labels
+        ]
+        self.array = np.full([len(labels) for labels in self.labels], np.nan)
+        self.array[tuple(codes)] = df[values].to_numpy()
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self.array[
+            tuple(positions[label] for positions, label in zip(self.positions, key))
+        ]
+
+
+class Lazy:
+    """
+    A value (e.g. Partitions of a table) which is only built,
+    by calling `build`, the first time it's used.  Several
+    threads may do so at once, it's still built once.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.value = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    self.value = self.build()
+        return self.value
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def partitions(name, keys, lazy=False):
+    """
+    Return the Partitions of the `name` table by `keys`, loaded
+    now or, if `lazy`, when first used.
+    """
+    if lazy:
+        return Lazy(lambda: partitions(name, keys))
+    df = load([name])[name]
+    start = time.perf_counter()
+    partitioned = Partitions(df, keys)
+    partition_times[name] = time.perf_counter() - start
+    return partitioned
+
+
+def pivots(name, specs, lazy=False):
+    """
+    Return {key: Pivot} of the `name` table, one per
+    `specs` item {key: (axes, values)}, all built from one
+    load of the table, now or, if `lazy`, when first used.
+    """
+    if lazy:
+        return Lazy(lambda: pivots(name, specs))
+    df = load([name])[name]
+    start = time.perf_counter()
+    pivoted = {key: Pivot(df, axes, values) for key, (axes, values) in specs.items()}
+    partition_times[name] = time.perf_counter() - start
+    return pivoted
+
+
+if __name__ == "__main__":
+    build_bundle()
+    print("Wrote " + bundle_file)
+    report(load(list(tables)))
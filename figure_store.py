@@ -0,0 +1,152 @@
+"""
+
+Static store of prebuilt figures.
+
+The figure callbacks only depend on a small, finite set of
+inputs and on data which changes only when preprocess.py is
+rerun, so every figure can be built ahead of time:
+
+    python figure_store.py
+
+This writes the figure JSON, compressed, into an SQLite file.
+Memoized callbacks (see cache.py) serve figures from it and
+only build them live if the store is missing, was built from
+other data, or doesn't have the figure.  The data is identified
+by the contents of its files (see `datasets.data_version`), so
+a committed store stays valid after a checkout or deploy.
+
+"""
+
+# pylint: disable=invalid-name, import-outside-toplevel
+import os
+import json
+import zlib
+import sqlite3
+import threading
+
+store_file = "figures.sqlite"
+
+# Version of the data the store was opened for, set by the app.
+# None means the store isn't used.
+data_version = None
+
+connections = threading.local()
+
+
+def key(name, args):
+    return json.dumps([name, list(args)])
+
+
+def connect():
+    """Open a read-only connection to the store."""
+    return sqlite3.connect("file:" + store_file + "?mode=ro", uri=True)
+
+
+def open_store(version):
+    """
+    Use the store if it was built from data `version`, as
+    given by `datasets.data_version`.
+    """
+    global data_version
+    data_version = None
+    if not os.path.exists(store_file):
+        return
+    db = connect()
+    try:
+        (built_from,) = db.execute(
+            "SELECT value FROM meta WHERE name = 'data_version'"
+        ).fetchone()
+    finally:
+        db.close()
+    if built_from != version:
+        print("Ignoring " + store_file + ", it was built from other data")
+        return
+    data_version = version
+
+
+def get(name, args):
+    """
+    Return the stored figure (as a dict) for callback `name`
+    called with `args`, or None.
+    """
+    if data_version is None:
+        return None
+
+    # One connection per thread (and per worker process,
+    # since they're only opened when first needed).
+    db = getattr(connections, "db", None)
+    if db is None:
+        db = connections.db = connect()
+
+    row = db.execute(
+        "SELECT figure FROM figures WHERE key = ?", (key(name, args),)
+    ).fetchone()
+    if row is None:
+        return None
+    return json.loads(zlib.decompress(row[0]))
+
+
+def combinations():
+    """
+    Yield (callback name, args) for every figure the app can show.
+    """
+    import luts
+
+    for community, c_name in luts.communities["place"].items():
+        yield "update_box_plots", (community, c_name)
+        yield "update_rose", (community, c_name)
+        yield "update_rose_monthly", (community, c_name)
+        for gcm in luts.gcms:
+            yield "update_future_rose", (community, c_name, gcm)
+            for duration in luts.durations:
+                yield "update_threshold_graph", (community, c_name, duration, gcm)
+            for decade in luts.decade_selections:
+                args = (community, c_name, gcm, decade)
+                yield "update_future_delta_percentiles", args
+
+
+def build():
+    """
+    Run every figure callback for every combination of
+    inputs and write the results to the store.
+    """
+    import plotly
+    import application
+    import datasets
+
+    tmp_file = store_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    db = sqlite3.connect(tmp_file)
+    db.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE figures (key TEXT PRIMARY KEY, figure BLOB)")
+    db.execute(
+        "INSERT INTO meta VALUES ('data_version', ?)", (datasets.data_version(),)
+    )
+
+    built = failed = 0
+    for name, args in combinations():
+        # Bypass the memoization, build each figure from scratch.
+        callback = getattr(application, name).__wrapped__
+        try:
+            figure = callback(*args)
+        except Exception as e:  # pylint: disable=broad-except
+            print("Skipping", name, args, "-", type(e).__name__, e)
+            failed += 1
+            continue
+        figure = json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+        db.execute(
+            "INSERT INTO figures VALUES (?, ?)",
+            (key(name, args), zlib.compress(figure.encode(), 9)),
+        )
+        built += 1
+
+    db.commit()
+    db.execute("VACUUM")
+    db.close()
+    os.replace(tmp_file, store_file)
+    print("Stored", built, "figures in", store_file + ",", failed, "failed")
+
+
+if __name__ == "__main__":
+    build()
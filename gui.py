@@ -301,6 +301,16 @@ form_fields = html.Div(
             children='<p class="content is-size-5 camera-icon">Click the <span><svg viewBox="0 0 1000 1000" class="icon" height="1em" width="1em"><path d="m500 450c-83 0-150-67-150-150 0-83 67-150 150-150 83 0 150 67 150 150 0 83-67 150-150 150z m400 150h-120c-16 0-34 13-39 29l-31 93c-6 15-23 28-40 28h-340c-16 0-34-13-39-28l-31-94c-6-15-23-28-40-28h-120c-55 0-100-45-100-100v-450c0-55 45-100 100-100h800c55 0 100 45 100 100v450c0 55-45 100-100 100z m-400-550c-138 0-250 112-250 250 0 138 112 250 250 250 138 0 250-112 250-250 0-138-112-250-250-250z m365 380c-19 0-35 16-35 35 0 19 16 35 35 35 19 0 35-16 35-35 0-19-16-35-35-35z" transform="matrix(1 0 0 -1 0 850)"></path></svg></span> icon in the upper&ndash;right of each chart to download it.</p>',
         ),
         communities_dropdown_field,
+        # Shipped once to the browser for the clientside
+        # callbacks (see assets/50_clientside.js).
+        dcc.Store(
+            id="client-data",
+            data={
+                "places": luts.communities.to_dict("index"),
+                "config": luts.fig_configs(),
+                "exports": luts.export_options,
+            },
+        ),
         dcc.Graph(
             id="map",
             figure=map_figure,
@@ -408,7 +418,7 @@ Use this box-plot to explore seasonal changes in wind speed. Each month’s data
                                         dcc.Graph(
                                             id="means_box",
                                             figure=go.Figure(),
-                                            config=luts.fig_configs,
+                                            config=luts.fig_configs(),
                                         ),
                                     ],
                                 ),
@@ -433,7 +443,7 @@ This wind rose shows prevailing wind direction and speed for a given location. D
                                         dcc.Graph(
                                             id="rose",
                                             figure=go.Figure(),
-                                            config=luts.fig_configs,
+                                            config=luts.fig_configs(),
                                         ),
                                     ],
                                 ),
@@ -454,7 +464,7 @@ These wind roses are similar to the one shown above, except data are separated b
                                         dcc.Graph(
                                             id="rose_monthly",
                                             figure=go.Figure(),
-                                            config=luts.fig_configs,
+                                            config=luts.fig_configs(),
                                         ),
                                     ],
                                 ),
@@ -497,7 +507,7 @@ Explore how the length and intensity of wind events may change. To start, use th
                                         dcc.Graph(
                                             id="threshold_graph",
                                             figure=go.Figure(),
-                                            config=luts.fig_configs,
+                                            config=luts.fig_configs(),
                                         ),
                                     ],
                                 ),
@@ -524,7 +534,7 @@ This chart shows how wind events may change over time.  Some types of wind event
                                         dcc.Graph(
                                             id="future_delta_percentiles",
                                             figure=go.Figure(),
-                                            config=luts.fig_configs,
+                                            config=luts.fig_configs(),
                                         ),
                                     ],
                                 ),
@@ -545,7 +555,7 @@ This chart shows how wind events may change over time.  Some types of wind event
                                         dcc.Graph(
                                             id="future_rose",
                                             figure=go.Figure(),
-                                            config=luts.fig_configs,
+                                            config=luts.fig_configs(),
                                         ),
                                     ],
                                 ),
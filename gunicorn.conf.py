@@ -0,0 +1,37 @@
+"""
+
+Gunicorn settings for serving the app:
+
+    gunicorn -c gunicorn.conf.py application:application
+
+The app is imported once in the master process, which loads
+and partitions the data, then forked into the workers.  The
+data is held in numeric / categorical numpy arrays, so the
+workers share the master's pages copy-on-write instead of
+each building their own copy.  Set CW_PRELOAD=0 to import the
+app in each worker instead.
+
+"""
+
+# pylint: disable=invalid-name
+import os
+import gc
+import multiprocessing
+
+bind = "0.0.0.0:" + os.getenv("PORT", "8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+preload_app = os.getenv("CW_PRELOAD", "1") != "0"
+
+# Callbacks don't share mutable state (see stress_app.py), so each
+# worker can serve several requests at once with threads.
+threads = int(os.getenv("CW_THREADS", "4"))
+
+
+def when_ready(server):  # pylint: disable=unused-argument
+    """
+    Move everything the master loaded out of the garbage
+    collector's reach, so collections in the workers don't
+    write to (and so copy) the shared pages.
+    """
+    if preload_app:
+        gc.freeze()
@@ -4,12 +4,13 @@
 Contains common lookup tables between GUI/application code
 
 """
+
 import os
-import pandas as pd
 import numpy as np
 import plotly.graph_objs as go
+import datasets
 
-communities = pd.read_csv("places.csv", index_col="sid")
+communities = datasets.load(["places"])["places"]
 
 # Needs to be a numpy array for ease of building relevant
 # strings for some code
@@ -89,32 +90,57 @@ map_layout = go.Layout(
 )
 
 
-# Common configuration for graph figures
+# Common configuration for graph figures.  These are shared by
+# every request, use fig_configs() to get a copy.
 fig_download_configs = dict(filename="winds", width="1280", scale=2)
-fig_configs = dict(
-    displayModeBar=True,
-    showSendToCloud=False,
-    toImageButtonOptions=fig_download_configs,
-    modeBarButtonsToRemove=[
-        "zoom2d",
-        "pan2d",
-        "select2d",
-        "lasso2d",
-        "zoomIn2d",
-        "zoomOut2d",
-        "autoScale2d",
-        "resetScale2d",
-        "hoverClosestCartesian",
-        "hoverCompareCartesian",
-        "hoverClosestPie",
-        "hoverClosest3d",
-        "hoverClosestGl2d",
-        "hoverClosestGeo",
-        "toggleHover",
-        "toggleSpikelines",
-    ],
-    displaylogo=False,
-)
+fig_mode_bar_buttons_to_remove = [
+    "zoom2d",
+    "pan2d",
+    "select2d",
+    "lasso2d",
+    "zoomIn2d",
+    "zoomOut2d",
+    "autoScale2d",
+    "resetScale2d",
+    "hoverClosestCartesian",
+    "hoverCompareCartesian",
+    "hoverClosestPie",
+    "hoverClosest3d",
+    "hoverClosestGl2d",
+    "hoverClosestGeo",
+    "toggleHover",
+    "toggleSpikelines",
+]
+
+
+def fig_configs():
+    """
+    Return a new config for graph figures.
+    """
+    return dict(
+        displayModeBar=True,
+        showSendToCloud=False,
+        toImageButtonOptions=dict(fig_download_configs),
+        modeBarButtonsToRemove=list(fig_mode_bar_buttons_to_remove),
+        displaylogo=False,
+    )
+
+
+# Download options for the charts whose exports are named after
+# the selected community (the name is prepended to the title).
+export_options = {
+    "means_box": dict(title="Average Wind Speeds, 1980-2014", height="640"),
+    "rose": dict(
+        title="Wind Frequency and Strength by Direction, 1980-2014",
+        width="1280",
+        height="1280",
+    ),
+    "rose_monthly": dict(
+        title="Monthly Wind Frequency and Strength by Direction, 1980-2014",
+        width="1024",
+        height="1280",
+    ),
+}
 
 # Gradient-colors, from gentlest to darker/more saturated.
 # Some charts need to access these directly.
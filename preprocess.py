@@ -8,112 +8,367 @@ some adjustments.
 """
 
 # pylint: disable=all
+import numpy as np
 import pandas as pd
 import dask.dataframe as dd
 import os
-from datetime import datetime
-from luts import speed_ranges
+import json
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from luts import speed_ranges, durations, bubble_bins
 
 directory = "./data/station"
-cols = ["sid", "direction", "speed", "month"]
+wrf_directory = "./data/wrf_adj"
 
+# Records the state of every input file as of the last run.
+manifest_file = "manifest.json"
 
-def preprocess_stations():
+
+def write_table(table, filename, sids=None, order=None):
+    """
+    Write an output table.  If `sids` is given, `table` only
+    holds those stations: their rows in the existing file are
+    replaced, and the rest are kept.  Rows stay sorted by sid,
+    or in `order` if given, keeping the order within a sid.
+    """
+    parquet = filename.endswith(".parquet")
+    if sids is not None and os.path.exists(filename):
+        if parquet:
+            existing = pd.read_parquet(filename)
+        else:
+            existing = pd.read_csv(filename, index_col=0, float_precision="round_trip")
+        existing = existing.loc[~existing["sid"].isin(sids)]
+        table = pd.concat([existing, table], ignore_index=True)
+
+    key = None
+    if order is not None:
+        rank = {sid: i for i, sid in enumerate(order)}
+        key = lambda sid: sid.map(rank)
+    table = table.sort_values("sid", kind="stable", key=key, ignore_index=True)
+    if parquet:
+        table.to_parquet(filename, index=False)
+    else:
+        table.to_csv(filename)
+
+
+# Columns of the IEM station files we never use,
+# and types of the ones we do.
+station_dropped = ["sped", "t_actual"]
+station_dtypes = {"drct": "float64", "sped_adj": "float64", "t_round": "str"}
+
+# Rows read from a station file at a time.
+station_chunksize = 250000
+
+# Mergeable partial aggregates the outputs are derived from,
+# see `monthly_stats` and `rose_counts`.
+stats_file = "monthly_stats.parquet"
+rose_counts_file = "rose_counts.parquet"
+
+# Parquet dataset of all station observations, partitioned
+# by sid and year, and the compact types it's stored with.
+stations_dataset = "stations.parquet"
+stations_schema = {
+    "direction": "float32",
+    "speed": "float32",
+    "month": "int16",
+    "year": "int16",
+}
+
+
+def preprocess_stations(filenames=None, removed_sids=(), known_sids=None):
+    """
+    This produces one (large) Parquet dataset which combines
+    all the individual station files into one tidy table,
+    partitioned by sid and year.
+
+    It includes direction=0 and speed=0 observations, which are
+    needed for calms and averages.  The wind roses filter them
+    out when reading (see `read_stations`) to avoid north bias.
+
+    Any rows with N/A values are dropped.
+
+    Station files are streamed in chunks which are appended
+    straight to the dataset, so memory use doesn't grow with
+    the number or size of the station files.
+
+    By default the dataset is rebuilt from every station file.
+    If `filenames` is given, the partitions of the sids they
+    hold (plus `removed_sids`) are rebuilt, from those files
+    and from every other file holding one of these sids, looked
+    up in `known_sids`, {filename: [sids]} of the last run.
+    Returns {filename: [sids]} for the files read.
     """
-    This producess two (large) files which combine
-    all the individual station files into one tidy table.
+    print("*** Preprocessing station data for wind roses & averages... ***")
+    print("Looking for station CSV files in ", directory)
+
+    if filenames is None:
+        shutil.rmtree(stations_dataset, ignore_errors=True)
+        filenames = sorted(os.listdir(directory))
+    else:
+        filenames, sids = station_files(filenames, removed_sids, known_sids or {})
+        for sid in sids:
+            shutil.rmtree(
+                os.path.join(stations_dataset, "sid=" + sid), ignore_errors=True
+            )
+
+    file_sids = {}
+    for filename in filenames:
+        file_sids[filename] = []
+        for d in read_station_file(os.path.join(directory, filename)):
+            for sid in d["sid"].unique():
+                if sid not in file_sids[filename]:
+                    file_sids[filename].append(sid)
+            d.to_parquet(stations_dataset, partition_cols=["sid", "year"], index=False)
 
-    stations.csv is ready to be processed into the wind roses.
-    Values with direction=0 or speed=0 are dropped to avoid
-    north bias.
+    return file_sids
 
-    mean_stations.csv includes direction=0 and speed=0.
 
-    For both, any rows with N/A values are dropped.
+def station_files(filenames, removed_sids, known_sids):
+    """
+    Return (files, sids) to rebuild after `filenames` changed:
+    a station's partition can only be rewritten from all of
+    the files holding it, and those files may hold other
+    stations, which then need all of their files too.
     """
-    if preprocess:
-        print("*** Preprocessing station data for wind roses & averages... ***")
-        print("Looking for station CSV files in ", directory)
+    sids = set(removed_sids)
+    for filename in filenames:
+        sids.update(station_file_sids(os.path.join(directory, filename)))
+
+    files = set(filenames)
+    while True:
+        extra = {
+            filename
+            for filename, file_sids in known_sids.items()
+            if filename not in files and sids.intersection(file_sids)
+        }
+        if not extra:
+            return sorted(files), sorted(sids)
+        files |= extra
+        for filename in extra:
+            sids.update(known_sids[filename])
+
+
+def station_file_sids(path):
+    """
+    Return the sids in an IEM station file, reading only its
+    first (station) column.
+    """
+    sids = set()
+    for d in pd.read_csv(path, usecols=[0], dtype="str", chunksize=station_chunksize):
+        sids.update(d.iloc[:, 0].dropna().unique())
+    return sids
 
-        data = pd.DataFrame(columns=cols)
-        mean_data = pd.DataFrame(columns=cols)
 
-        for filename in os.listdir(directory):
-            d = pd.read_csv(os.path.join(directory, filename))
+def read_station_file(path):
+    """
+    Stream an IEM station file as cleaned chunks.
+    """
+    chunks = pd.read_csv(
+        path,
+        usecols=lambda column: column not in station_dropped,
+        dtype=station_dtypes,
+        chunksize=station_chunksize,
+    )
+    for d in chunks:
+        yield prepare_station_chunk(d)
 
-            # Throw away columns we won't use, and null values
-            d = d.drop(columns=["sped", "t_actual"])
-            d = d.dropna()
 
-            # Copy for slightly different treatment of
-            # station data for averages
-            m = d.copy(deep=True)
+def prepare_station_chunk(d):
+    """
+    Clean one chunk of a station file into
+    sid/direction/speed/month/year rows.
+    """
+    # Throw away null values
+    d = d.dropna()
 
-            # Toss rows where direction is 0, because
-            # this represents unclear direction.  Otherwise,
-            # the data has a "north bias."  Also drop
-            # values where the speed is 0 (calm)
-            # for the wind roses.
-            d = d[d["drct"] != 0]
-            d = d[d["sped_adj"] != 0]
+    # Pull month and year out of t_round column.
+    d = d.assign(month=pd.to_numeric(d["t_round"].str.slice(5, 7)))
+    d = d.assign(year=pd.to_numeric(d["t_round"].str.slice(0, 4)))
+    d = d.drop(columns=["t_round"])
 
-            # Pull month out of t_round column.
-            d = d.assign(month=pd.to_numeric(d["t_round"].str.slice(5, 7)))
-            m = m.assign(month=pd.to_numeric(m["t_round"].str.slice(5, 7)))
-            m = m.assign(year=pd.to_numeric(m["t_round"].str.slice(0, 4)))
-            d = d.drop(columns=["t_round"])
-            m = m.drop(columns=["t_round"])
+    # Rename remaining columns
+    d.columns = ["sid", "direction", "speed", "month", "year"]
+    return d.astype(stations_schema)
 
-            # Rename remaining columns
-            d.columns = cols
-            m.columns = ["sid", "direction", "speed", "month", "year"]
-            data = data.append(d)
-            mean_data = mean_data.append(m)
 
-        data.to_csv("stations.csv")
-        mean_data.to_csv("mean_stations.csv")
+def read_stations(columns, roses=False, sids=None):
+    """
+    Lazily read `columns` of the station dataset as a Dask
+    dataframe.  Only the `sids` partitions are read, if given.
+
+    With `roses`, rows where direction is 0 are tossed, because
+    this represents unclear direction.  Otherwise, the data has
+    a "north bias."  Calm (speed 0) rows are also dropped.
+    """
+    filters = []
+    if sids is not None:
+        filters.append(("sid", "in", list(sids)))
+    if roses:
+        filters += [("direction", "!=", 0), ("speed", "!=", 0)]
+
+    d = dd.read_parquet(stations_dataset, columns=columns, filters=filters or None)
+    if roses:
+        # Partitions are pruned by the filters above, but rows
+        # inside each file still need to be dropped.
+        d = d[(d["direction"] != 0) & (d["speed"] != 0)]
+    return d
 
 
 # Needs Dask DF not Pandas.
-def averages_by_month(mean_data):
+def monthly_stats(mean_data):
+    """
+    Aggregate observations per station/year/month in one
+    pass: number of observations (`total`), number of calm
+    observations (speed == 0), number of observations used
+    for the wind roses (`rose_total`, see `read_stations`),
+    and the sum and sum of squares of the speeds.
+
+    These are all mergeable, so stats of new observations can
+    be added to stored ones (see `merge_stats`).  Calms and
+    averages are both derived from this table.
+    """
+    print("*** Aggregating station data by month... ***")
+    speed = mean_data["speed"].astype("float64")
+    d = mean_data.assign(
+        speed=speed,
+        speed_sq=speed**2,
+        calm=(speed == 0).astype("int64"),
+        rose=((mean_data["direction"] != 0) & (speed != 0)).astype("int64"),
+    )
+    d = d.groupby(["sid", "year", "month"], observed=True).agg(
+        {"speed": ["count", "sum"], "speed_sq": "sum", "calm": "sum", "rose": "sum"}
+    )
+    if isinstance(d, dd.DataFrame):
+        d = d.compute()
+    d = d.sort_index()
+    d.columns = ["total", "speed_sum", "speed_sq_sum", "calm", "rose_total"]
+
+    # Drop indices and get table in good shape
+    d = d.reset_index()
+    d = d.astype({"sid": "str", "year": "int16", "month": "int16"})
+    return d[stats_cols]
+
+
+stats_cols = [
+    "sid",
+    "year",
+    "month",
+    "total",
+    "calm",
+    "rose_total",
+    "speed_sum",
+    "speed_sq_sum",
+]
+
+
+def merge_stats(tables):
+    """
+    Combine a list of `monthly_stats` tables.
+    """
+    d = pd.concat(tables, ignore_index=True)
+    d = d.groupby(["sid", "year", "month"], as_index=False).sum()
+    return d[stats_cols]
+
+
+def averages_by_month(stats, sids=None):
     """
     Compute averages for each month by year.
     """
     print("*** Precomputing monthly averages by year... ***")
-    d = mean_data.groupby(["sid", "year", "month"]).mean().compute()
+    d = stats[["sid", "year", "month"]]
+    d = d.assign(speed=round(stats["speed_sum"] / stats["total"], 1))
+    write_table(d, "monthly_averages.csv", sids)
 
-    # Drop indices and get table in good shape for writing
-    d = d.reset_index()
-    d = d.drop(["direction"], axis=1)
-    # Weird code -- drop the prior index, which is unnamed
-    d = d.loc[:, ~d.columns.str.contains("^Unnamed")]
-    d = d.astype({"year": "int16", "month": "int16"})
-    d = d.assign(speed=round(d["speed"], 1))
-    d.to_csv("monthly_averages.csv")
 
-
-# Requires Dask DF, not Pandas
-def process_calm(mean_data):
+def process_calm(stats, sids=None):
     """
-    For each station/year/month, generate a count
+    For each station/month, generate a count
     of # of calm measurements.
     """
     print("*** Generating calm counts... ***")
 
-    # Create temporary structure which holds
-    # total wind counts and counts where calm to compute
-    # % of calm measurements.
-    t = mean_data.groupby(["sid", "month"]).size().reset_index().compute()
-    calms = t
+    # Totals of wind counts and counts where calm,
+    # to compute % of calm measurements.
+    calms = stats.groupby(["sid", "month"])[["total", "calm"]].sum().reset_index()
+    calms = calms.assign(percent=round(calms["calm"] / calms["total"], 3) * 100)
+    write_table(calms, "calms.csv", sids)
 
-    # Only keep rows where speed == 0
-    d = mean_data[(mean_data["speed"] == 0)]
-    d = d.groupby(["sid", "month"]).size().reset_index().compute()
 
-    calms = calms.assign(calm=d[[0]])
-    calms.columns = ["sid", "month", "total", "calm"]
-    calms = calms.assign(percent=round(calms["calm"] / calms["total"], 3) * 100)
-    calms.to_csv("calms.csv")
+# Directions are binned into 36 classes.  Classes 1-35 are the
+# right-inclusive 10º sectors (5, 15], (15, 25] ... (345, 355].
+# Class 0 is the exceptional 355º - 5º (north) sector, which
+# would otherwise be annoying.
+direction_bins = np.arange(5, 356, 10)
+direction_classes = list(range(1, 36)) + [0]  # order rows are written in
+
+# Speed ranges are inclusive at both ends and share their edges,
+# so a reading exactly on an edge (e.g. 6 mph) counts towards
+# both neighbouring ranges.
+speed_lower = np.array([info["range"][0] for info in speed_ranges.values()])
+speed_upper = np.array([info["range"][1] for info in speed_ranges.values()])
+
+
+def bin_rose(direction, speed, groups=None, group_count=1):
+    """
+    Count observations into the 36 direction x 6 speed classes
+    in a single pass.
+
+    `groups` optionally assigns each observation an integer group
+    (0 to group_count - 1), so many roses can be binned at once.
+    Returns an integer array shaped (group_count, 36, 6), indexed
+    by group, direction class and speed range.
+    """
+    direction = np.asarray(direction, dtype="float64")
+    speed = np.asarray(speed, dtype="float64")
+    if groups is None:
+        groups = np.zeros(len(direction), dtype="int64")
+    groups = np.asarray(groups, dtype="int64")
+
+    dclass = np.searchsorted(direction_bins, direction, side="left")
+    dclass[~(direction > 5) | (direction > 355)] = 0
+
+    # Index of the first range whose upper edge is >= speed, then
+    # discard readings below the lowest / above the highest range.
+    sclass = np.searchsorted(speed_upper, speed, side="left")
+    valid = sclass < len(speed_upper)
+    sclass = np.where(valid, sclass, 0)
+    valid &= speed >= speed_lower[sclass]
+
+    size = group_count * len(direction_classes) * len(speed_upper)
+    keys = (groups * len(direction_classes) + dclass) * len(speed_upper) + sclass
+    counts = np.bincount(keys[valid], minlength=size)
+
+    # Readings on a shared edge are counted again in the next range up.
+    edge = valid & (sclass + 1 < len(speed_upper))
+    edge &= speed == speed_lower[np.minimum(sclass + 1, len(speed_upper) - 1)]
+    counts += np.bincount(keys[edge] + 1, minlength=size)
+
+    return counts.reshape(group_count, len(direction_classes), len(speed_upper))
+
+
+def counts_to_rose(counts, total, station_name=None):
+    """
+    Turn one (36, 6) matrix of counts from `bin_rose` into
+    the tidy sid/direction_class/speed_range/count/frequency
+    table, with frequency as % of `total` observations.
+    """
+    counts = counts[direction_classes].ravel()
+    frequency = 0
+    if total > 0:
+        # Python's round(), not np.round(), so values match the
+        # earlier per-bin implementation exactly.
+        frequency = [round(f, 2) for f in (counts / total * 100).tolist()]
+
+    return pd.DataFrame(
+        {
+            "sid": station_name,
+            "direction_class": np.repeat(direction_classes, len(speed_ranges)),
+            "speed_range": np.tile(list(speed_ranges.keys()), len(direction_classes)),
+            "count": counts,
+            "frequency": frequency,
+        }
+    )
 
 
 def chunk_to_rose(sgroup, station_name=None):
@@ -121,62 +376,14 @@ def chunk_to_rose(sgroup, station_name=None):
     Builds data suitable for Plotly's wind roses from
     a subset of data.
 
-    Given a subset of data, group by direction and speed.
-    Return accumulator of whatever the results of the
-    incoming chunk are.
-    """
-
-    # Bin into 36 categories.
-    bins = list(range(5, 356, 10))
-    bin_names = list(range(1, 36))
-
-    # Accumulator dataframe.
-    proc_cols = ["sid", "direction_class", "speed_range", "count"]
-    accumulator = pd.DataFrame(columns=proc_cols)
-
-    # Assign directions to bins.
-    # We'll use the exceptional 'NaN' class to represent
-    # 355º - 5º, which would otherwise be annoying.
-    # Assign 0 to that direction class.
-    ds = pd.cut(sgroup["direction"], bins, labels=bin_names)
-    sgroup = sgroup.assign(direction_class=ds.cat.add_categories("0").fillna("0"))
-
-    # First compute yearly data.
-    # For each direction class...
-    directions = sgroup.groupby(["direction_class"])
-    for direction, d_group in directions:
-
-        # For each wind speed range bucket...
-        for bucket, bucket_info in speed_ranges.items():
-            d = d_group.loc[
-                (
-                    sgroup["speed"].between(
-                        bucket_info["range"][0], bucket_info["range"][1], inclusive=True
-                    )
-                    == True
-                )
-            ]
-            count = len(d.index)
-            full_count = len(sgroup.index)
-            frequency = 0
-            if full_count > 0:
-                frequency = round(((count / full_count) * 100), 2)
-
-            accumulator = accumulator.append(
-                {
-                    "sid": station_name,
-                    "direction_class": direction,
-                    "speed_range": bucket,
-                    "count": count,
-                    "frequency": frequency,
-                },
-                ignore_index=True,
-            )
-
-    return accumulator
+    Given a subset of data, bin by direction and speed
+    and return the counts and frequencies of each bin.
+    """
+    counts = bin_rose(sgroup["direction"], sgroup["speed"])[0]
+    return counts_to_rose(counts, len(sgroup.index), station_name)
 
 
-def process_roses(data):
+def process_roses(counts, stats, sids=None):
     """
     For each station we need one trace for each direction.
 
@@ -192,33 +399,119 @@ def process_roses(data):
     speed_range - text fragment from luts.py for the speed class
     month - 0 for year, 1-12 for month
 
+    Built from the raw `rose_counts` and the `rose_total`
+    of the `monthly_stats`.
     """
     print("*** Preprocessing wind rose frequency counts... ***")
+    write_table(roses_by_month(counts, stats), "roses.csv", sids)
 
-    proc_cols = ["sid", "direction_class", "speed_range", "count", "month"]
-    rose_data = pd.DataFrame(columns=proc_cols)
 
-    groups = data.groupby(["sid"])
-    for station_name, station in groups:
-        # Yearly data.
-        t = chunk_to_rose(station)
-        t = t.assign(month=0)  # year
-        rose_data = rose_data.append(t)
+rose_keys = ["sid", "month", "direction_class", "speed_range"]
 
-        # Monthly data.
-        station_grouped_by_month = station.groupby(station["month"])
-        # TODO -- can this be rewritten to avoid looping
-        # over the groupby?  If so, it'd be much much faster.
-        for month, station_by_month in station_grouped_by_month:
-            acc = pd.DataFrame(columns=proc_cols)
-            t = chunk_to_rose(station_by_month, acc)
-            t = t.assign(month=month)
-            rose_data = rose_data.append(t)
 
-    rose_data.to_csv("roses.csv")
+def rose_counts(data):
+    """
+    Bin every station's monthly roses in one grouped pass over
+    `data`.  Returns the raw counts as a mergeable long table of
+    sid/month/direction_class/speed_range/count, with all bins
+    of every month which has observations.
+    """
+    sid_codes, sids = pd.factorize(data["sid"], sort=True)
+    groups = sid_codes * 12 + data["month"].to_numpy(dtype="int64") - 1
+
+    counts = bin_rose(data["direction"], data["speed"], groups, len(sids) * 12)
+    present = np.flatnonzero(np.bincount(groups, minlength=len(sids) * 12))
+    bins = len(direction_classes) * len(speed_ranges)
+
+    return pd.DataFrame(
+        {
+            "sid": np.repeat(np.asarray(sids, dtype="object")[present // 12], bins),
+            "month": np.repeat(present % 12 + 1, bins),
+            "direction_class": np.tile(
+                np.repeat(direction_classes, len(speed_ranges)), len(present)
+            ),
+            "speed_range": np.tile(list(speed_ranges.keys()), len(present) * 36),
+            "count": counts[present][:, direction_classes].ravel(),
+        }
+    )
+
+
+def merge_rose_counts(tables):
+    """
+    Combine a list of `rose_counts` tables.
+    """
+    d = pd.concat(tables, ignore_index=True)
+    return d.groupby(rose_keys, as_index=False, sort=False)["count"].sum()
 
 
-def process_future_roses():
+def roses_by_month(counts, stats):
+    """
+    Build every station's annual (month 0) and monthly roses
+    from `rose_counts`.  Annual counts are the sum of the
+    monthly counts rather than a second scan.
+    """
+    sid_codes, sids = pd.factorize(counts["sid"], sort=True)
+    speed_index = {sr: i for i, sr in enumerate(speed_ranges)}
+    matrix = np.zeros(
+        (len(sids), 13, len(direction_classes), len(speed_ranges)), "int64"
+    )
+    matrix[
+        sid_codes,
+        counts["month"].to_numpy(dtype="int64"),
+        counts["direction_class"].to_numpy(dtype="int64"),
+        counts["speed_range"].map(speed_index).to_numpy(dtype="int64"),
+    ] = counts["count"]
+    matrix[:, 0] = matrix[:, 1:].sum(axis=1)
+
+    t = stats.groupby(["sid", "month"])["rose_total"].sum()
+    t = t.unstack().reindex(index=sids, columns=range(13), fill_value=0)
+    totals = t.fillna(0).to_numpy(dtype="int64")
+    totals[:, 0] = totals[:, 1:].sum(axis=1)
+
+    roses = []
+    for i, sid in enumerate(sids):
+        for month in range(13):
+            # Months without any observations are left out,
+            # the annual rose is always written.
+            if month == 0 or totals[i, month] > 0:
+                t = counts_to_rose(matrix[i, month], totals[i, month], sid)
+                roses.append(t.assign(month=month))
+
+    return pd.concat(roses, ignore_index=True)
+
+
+# Define date ranges to be consistent
+era_end = 2009
+start_mid_century = 2025
+end_mid_century = 2054
+start_late_century = 2070
+end_late_century = 2099
+
+# Time windows of the future roses: which WRF file (by GCM prefix)
+# and model the rows come from, and the inclusive range of years.
+future_windows = pd.DataFrame(
+    [
+        ("CCSM4", "ERA", 0, 0, era_end),
+        ("CCSM4", "CCSM4", 1, start_mid_century, end_mid_century),
+        ("CCSM4", "CCSM4", 2, start_late_century, end_late_century),
+        ("CM3", "CM3", 1, start_mid_century, end_mid_century),
+        ("CM3", "CM3", 2, start_late_century, end_late_century),
+    ],
+    columns=["file", "gcm", "decadal_group", "start", "end"],
+)
+
+future_cols = [
+    "sid",
+    "gcm",
+    "decadal_group",
+    "direction_class",
+    "speed_range",
+    "count",
+    "frequency",
+]
+
+
+def process_future_roses(jobs=1, sids=None):
     """
     Process wind roses for future data.
 
@@ -226,83 +519,103 @@ def process_future_roses():
     0 = ERA, 1980-2009
     1 = CCSM4/CM3, 2025-2054
     2 = CCSM4/CM3, 2070-2099
+
+    See `future_windows` to change or add windows.
+
+    Places are processed independently, across `jobs` worker
+    processes.  Results are gathered in places.csv order, so
+    the output is the same as a serial run.  If `sids` is given,
+    only those places are rebuilt and spliced into the output.
     """
 
     places = pd.read_csv("./places.csv")
-    cols = [
-        "sid",
-        "gcm",
-        "decadal_group",
-        "direction_class",
-        "speed_range",
-        "count",
-        "frequency",
-    ]
+    order = places["sid"].tolist()
+    if sids is not None:
+        places = places.loc[places["sid"].isin(sids)]
+        if places.empty:
+            return
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            future_roses = list(executor.map(place_future_roses, places["sid"]))
+    else:
+        future_roses = [place_future_roses(sid) for sid in places["sid"]]
 
-    future_roses = pd.DataFrame(columns=cols)
-
-    # Define date ranges to be consistent
-    era_end = 2009
-    start_mid_century = 2025
-    end_mid_century = 2054
-    start_late_century = 2070
-    end_late_century = 2099
-
-    for index, place in places.iterrows():
-        print("[future roses] starting " + place["sid"])
-
-        # Read and prep for ERA/CCSM4.
-        df = pd.read_csv("./data/wrf_adj/CCSM4_" + place["sid"] + ".csv")
-        df.columns = ["gcm", "sid", "ts", "speed", "direction"]
-        df["ts"] = pd.to_datetime(df["ts"])
-        df["year"] = pd.DatetimeIndex(df["ts"]).year
-        df = df.set_index(["gcm", "year"])
-        df = df.reset_index()
-
-        dk = df.loc[(df.gcm == "ERA") & (df.year <= era_end)]
-        t = chunk_to_rose(dk, place["sid"])
-        t["gcm"] = "ERA"
-        t["decadal_group"] = 0
-        future_roses = future_roses.append(t)
-
-        # For both CCSM4 and CM3, we need two buckets --
-        # 2031 - 2050, and 2080-2099.
-        dk = df.loc[(df.gcm == "CCSM4") & (df.year >= start_mid_century) & (df.year <= end_mid_century)]
-        t = chunk_to_rose(dk, place["sid"])
-        t["gcm"] = "CCSM4"
-        t["decadal_group"] = 1
-        future_roses = future_roses.append(t)
-
-        dk = df.loc[(df.gcm == "CCSM4") & (df.year >= start_late_century) & (df.year <= end_late_century)]
-        dk = dk.reset_index()  # for performance.
-        t = chunk_to_rose(dk, place["sid"])
-        t["gcm"] = "CCSM4"
-        t["decadal_group"] = 2
-        future_roses = future_roses.append(t)
-
-        # Read & prep CM3
-        df = pd.read_csv("./data/wrf_adj/CM3_" + place["sid"] + ".csv")
-        df.columns = ["gcm", "sid", "ts", "speed", "direction"]
-        df["ts"] = pd.to_datetime(df["ts"])
-        df["year"] = pd.DatetimeIndex(df["ts"]).year
-        df = df.set_index(["gcm", "year"])
-        df = df.reset_index()
-
-        dk = df.loc[(df.gcm == "CM3") & (df.year >= start_mid_century) & (df.year <= end_mid_century)]
-        dk = dk.reset_index()  # for performance.
-        t = chunk_to_rose(dk, place["sid"])
-        t["gcm"] = "CM3"
-        t["decadal_group"] = 1
-        future_roses = future_roses.append(t)
-
-        dk = df.loc[(df.gcm == "CM3") & (df.year >= start_late_century) & (df.year <= end_late_century)]
-        dk = dk.reset_index()  # for performance.
-        t = chunk_to_rose(dk, place["sid"])
-        t["gcm"] = "CM3"
-        t["decadal_group"] = 2
-        future_roses = future_roses.append(t)
-
-    future_roses.to_csv("future_roses.csv")
+    future_roses = pd.concat(future_roses, ignore_index=True)
+    write_table(future_roses, "future_roses.csv", sids, order)
+
+
+def remove_future_roses(sids):
+    """
+    Drop the future roses of places whose WRF files are gone.
+    """
+    if not os.path.exists("future_roses.csv"):
+        return
+    future_roses = pd.read_csv(
+        "future_roses.csv", index_col=0, float_precision="round_trip"
+    )
+    future_roses = future_roses.loc[~future_roses["sid"].isin(sids)]
+    future_roses.reset_index(drop=True).to_csv("future_roses.csv")
+
+
+def place_future_roses(sid):
+    """
+    Build the roses of every window in `future_windows` for
+    one place.  Each WRF file is read once; rows are labelled
+    with their window in one lookup and binned together.
+    """
+    print("[future roses] starting " + sid)
+
+    window_count = len(future_windows.index)
+    counts = np.zeros(
+        (window_count, len(direction_classes), len(speed_ranges)), "int64"
+    )
+    totals = np.zeros(window_count, "int64")
+
+    for prefix, windows in future_windows.groupby("file", sort=False):
+        df = pd.read_csv(
+            "./data/wrf_adj/" + prefix + "_" + sid + ".csv",
+            header=0,
+            names=["gcm", "sid", "ts", "speed", "direction"],
+            usecols=["gcm", "ts", "speed", "direction"],
+            dtype={
+                "gcm": "category",
+                "ts": "str",
+                "speed": "float64",
+                "direction": "float64",
+            },
+        )
+
+        # Window lookup by (gcm, year).  The extra last row and column
+        # are -1 and catch unknown models and out-of-range years.
+        gcms = windows["gcm"].unique()
+        last_year = windows["end"].max() + 1
+        lookup = np.full((len(gcms) + 1, last_year + 1), -1)
+        for index, window in windows.iterrows():
+            gcm = np.flatnonzero(gcms == window["gcm"])[0]
+            lookup[gcm, window["start"] : window["end"] + 1] = index
+
+        gcm_codes = pd.Categorical(df["gcm"], categories=gcms).codes
+        years = np.clip(df["ts"].str.slice(0, 4).astype("int64"), 0, last_year)
+        labels = lookup[gcm_codes, years]
+
+        keep = labels >= 0
+        counts += bin_rose(
+            df["direction"].to_numpy()[keep],
+            df["speed"].to_numpy()[keep],
+            labels[keep],
+            window_count,
+        )
+        totals += np.bincount(labels[keep], minlength=window_count)
+
+    future_roses = []
+    for index, window in future_windows.iterrows():
+        t = counts_to_rose(counts[index], totals[index], sid)
+        t["gcm"] = window["gcm"]
+        t["decadal_group"] = window["decadal_group"]
+        future_roses.append(t)
+
+    return pd.concat(future_roses, ignore_index=True)[future_cols]
 
 
 def process_threshold_percentiles():
@@ -313,21 +626,378 @@ def process_threshold_percentiles():
     dk.to_csv("percentiles.csv")
 
 
-# Make already-done V2 work skippable.
-v2_preprocess = True
-if v2_preprocess:
-    # process_threshold_percentiles()
-    process_future_roses()
+def threshold_ranks(dt):
+    """
+    Return the percentile of every wind speed threshold of each
+    station and model (rows of percentiles.csv), as an index in
+    luts.percentiles: stid, gcm, ws_thr, percentile.
+    """
+    ranks = dt[["stid", "gcm", "ws_thr"]].drop_duplicates()
+
+    # A station's models share its 5 thresholds (some may have
+    # no events), except at a few stations where each model has
+    # its own: rank those per model.
+    thresholds = ranks.groupby("stid")["ws_thr"].transform("nunique")
+    ranks["group"] = ranks["gcm"].where(thresholds > 5, "")
+
+    groups = ranks[["stid", "group", "ws_thr"]].drop_duplicates()
+    groups = groups.sort_values(["stid", "group", "ws_thr"])
+    groups["percentile"] = groups.groupby(["stid", "group"]).cumcount()
+
+    # Some stations (e.g. PADK) only have 4 thresholds, because
+    # their 85th/95th percentiles are identical: the last one
+    # is the 99th.
+    count = groups.groupby(["stid", "group"])["ws_thr"].transform("size")
+    groups.loc[(count == 4) & (groups["percentile"] == 3), "percentile"] = 4
+
+    ranks = ranks.merge(groups, on=["stid", "group", "ws_thr"])
+    return ranks.drop(columns="group")
+
 
-# Make all V1 work skippable.
-v1_preprocess = False
+def era_first(df):
+    """Sort the ERA-Interim rows of `df` first."""
+    return df.sort_values("gcm", key=lambda g: g != "ERA", kind="stable")
 
-if v1_preprocess:
-    preprocess_stations()
 
-    data = pd.read_csv("stations.csv", index_col=[0])
-    mean_data = dd.read_csv("mean_stations.csv")
+def delta_percentiles(events, ranks, gcm, decade):
+    """
+    Compare the wind events of one station (rows of
+    percentiles.csv) in a model `gcm` and `decade` with
+    ERA-Interim 1980-1999, with everything the app shows
+    for each threshold: change, marker size and labels.
+    `ranks` are the station's threshold_ranks.
+    """
+    de = events.loc[(events.gcm == "ERA") & (events.ts == 1980)]
+    dc = events.loc[(events.gcm == gcm) & (events.ts == decade)]
+
+    dec = de.groupby(["ws_thr", "dur_thr"])[["events"]].sum()
+    dcc = dc.groupby(["ws_thr", "dur_thr"])[["events"]].sum()
+
+    # Merge the two dataframes (outer join)
+    # Outer join ensures wind events present in either
+    # dataframe are included (union)
+    dj = dcc.join(dec, how="outer", lsuffix="_model", rsuffix="_ERA")
+    dj = dj.fillna(0)  # so we can subtract
+    dj["delta"] = dj["events_model"] - dj["events_ERA"]
+    dj = dj.reset_index()
+
+    # Compute % change between baseline and model
+    # Handle NaN and NA values, then round to integer.
+    dj["percent_change"] = (dj["delta"] / dj["events_ERA"]) * 100
+    dj["percent_change"] = (
+        dj["percent_change"].replace([np.inf], 0).fillna(0).round(0).astype("int")
+    )
+
+    # Group magnitude of changes into 5 quantiles, and size
+    # the bubbles by them.  Take absolute value to show
+    # magnitude, since color shows +/-.
+    magnitude = dj["delta"].abs()
+    try:
+        bins = pd.qcut(magnitude, 5, labels=False)
+    except ValueError:
+        # Too many equal changes for 5 distinct quantiles,
+        # break the ties by order.
+        bins = pd.qcut(
+            magnitude.rank(method="first"), 5, labels=False, duplicates="drop"
+        )
+    dj["marker_size"] = np.array(list(bubble_bins.values()))[bins]
+
+    # Format hover text nicely.
+    delta = dj["delta"].astype("int").to_numpy()
+    events_era = dj["events_ERA"].astype("int").to_numpy()
+    hover_text = np.where(
+        events_era != 0,
+        "<b>"
+        + dj["percent_change"].astype("str")
+        + np.where(delta > 0, "% more</b> events,<br>", "% fewer</b> events,<br>"),
+        "<b>" + delta.astype("str") + " new events</b>,<br>",
+    )
+    hover_text = (
+        hover_text
+        + dj["ws_thr"].astype("str")
+        + "mph<br>"
+        + dj["dur_thr"].map(durations).astype("str")
+    )
+    dj["hover_text"] = np.where(delta == 0, "No change", hover_text)
+
+    # Annotations show changed number of events.  Add a + sign
+    # if the row is positive, and format the numbers nicely.
+    dj["annotations"] = (
+        "<b>"
+        + np.where(dj["delta"] > 0, "+", "")
+        + pd.Series(delta, index=dj.index).map("{:,}".format)
+        + "</b>"
+    )
+
+    # Magic number 20 = trial and error for the
+    # threshold at which the bubbles _generally_ look
+    # better with the text annotation to the right.
+    dj["annotations_positions"] = np.where(
+        dj["marker_size"] > 20, "middle center", "middle right"
+    )
+
+    # Percentile of each threshold, ERA-Interim's if
+    # the model has the same threshold for another one.
+    ranks = era_first(ranks.loc[ranks.gcm.isin(["ERA", gcm])])
+    ranks = ranks.drop_duplicates("ws_thr").set_index("ws_thr")["percentile"]
+    dj["percentile"] = dj["ws_thr"].map(ranks)
+    return dj
+
+
+def process_delta_percentiles():
+    """
+    Precompute the changes in wind events between
+    ERA-Interim and every model and decade, for every
+    station, so the app only has to look them up.
+    """
+    print("*** Preprocessing delta percentiles ***")
+    dt = pd.read_csv("percentiles.csv", index_col=0)
+    ranks = threshold_ranks(dt)
+    tables = []
+    for stid, events in dt.groupby("stid"):
+        station_ranks = ranks.loc[ranks.stid == stid]
+        models = events.loc[events.gcm != "ERA", ["gcm", "ts"]].drop_duplicates()
+        for gcm, decade in models.sort_values(["gcm", "ts"]).itertuples(index=False):
+            dj = delta_percentiles(events, station_ranks, gcm, decade)
+            dj.insert(0, "stid", stid)
+            dj.insert(1, "gcm", gcm)
+            dj.insert(2, "decade", decade)
+            tables.append(dj)
+    dj = pd.concat(tables, ignore_index=True)
+    dj["events_model"] = dj["events_model"].astype("int")
+    dj["events_ERA"] = dj["events_ERA"].astype("int")
+    dj["delta"] = dj["delta"].astype("int")
+    dj.to_csv("delta_percentiles.csv")
+
+
+def process_threshold_events():
+    """
+    Total the wind events of every station, model, duration,
+    percentile and decade for the threshold chart, with the
+    ERA-Interim decades (1980, 2000) included in each model's.
+    Each percentile is labelled with its threshold, ERA-Interim's
+    if the model's differs.
+    """
+    print("*** Preprocessing threshold events ***")
+    dt = pd.read_csv("percentiles.csv", index_col=0)
+    ranks = threshold_ranks(dt)
+    dt = dt.merge(ranks, on=["stid", "gcm", "ws_thr"])
+
+    tables = []
+    for gcm in sorted(set(dt.gcm) - {"ERA"}):
+        dm = dt.loc[dt.gcm.isin(["ERA", gcm])].assign(gcm=gcm)
+        dm = dm.groupby(["stid", "gcm", "dur_thr", "percentile", "ts"])["events"].sum()
+        thresholds = era_first(ranks.loc[ranks.gcm.isin(["ERA", gcm])])
+        thresholds = thresholds.drop_duplicates(["stid", "percentile"])
+        thresholds = thresholds.set_index(["stid", "percentile"])["ws_thr"]
+        tables.append(dm.reset_index().join(thresholds, on=["stid", "percentile"]))
+    pd.concat(tables, ignore_index=True).to_csv("threshold_events.csv")
+
+
+def process_station_aggregates(stats, counts, sids=None):
+    """
+    Store the partial aggregates and derive calms,
+    averages and roses from them.
+    """
+    write_table(stats, stats_file, sids)
+    write_table(counts, rose_counts_file, sids)
+    process_calm(stats, sids)
+    averages_by_month(stats, sids)
+    process_roses(counts, stats, sids)
+
+
+def append_observations(paths):
+    """
+    Add a batch of new IEM observations, e.g. the last few
+    months of a station, without a full rebuild.  The batch
+    is appended to the station dataset, and its aggregates
+    are merged into the stored ones; only the stations in
+    the batch are rewritten in the outputs.
+
+    Each batch file is also copied into the station directory
+    and recorded in the manifest, so later full or incremental
+    rebuilds of its stations include it, and give the same
+    outputs as this append.
+
+    The batch must not overlap observations already ingested,
+    or they would be counted twice.  Needs the aggregates of
+    an earlier full run.
+    """
+    print("*** Appending observations from", ", ".join(paths), "***")
+    targets = [os.path.join(directory, os.path.basename(path)) for path in paths]
+    for path, target in zip(paths, targets):
+        if os.path.exists(target) and not os.path.samefile(path, target):
+            raise RuntimeError(target + " already exists, rename the batch file")
+
+    manifest = load_manifest()
+    stats = []
+    counts = []
+    for path, target in zip(paths, targets):
+        file_sids = []
+        for d in read_station_file(path):
+            for sid in d["sid"].unique():
+                if sid not in file_sids:
+                    file_sids.append(sid)
+            d.to_parquet(stations_dataset, partition_cols=["sid", "year"], index=False)
+            stats.append(monthly_stats(d))
+            roses = d.loc[(d["direction"] != 0) & (d["speed"] != 0)]
+            counts.append(rose_counts(roses))
+        if not os.path.exists(target):
+            shutil.copyfile(path, target)
+        manifest[target] = {**file_state(target), "sids": file_sids}
+
+    stats = merge_stats(stats)
+    sids = sorted(stats["sid"].unique())
+    stored_stats = pd.read_parquet(stats_file, filters=[("sid", "in", sids)])
+    stored_counts = pd.read_parquet(rose_counts_file, filters=[("sid", "in", sids)])
+    process_station_aggregates(
+        merge_stats([stored_stats, stats]),
+        merge_rose_counts([stored_counts] + counts),
+        sids,
+    )
+    save_manifest(manifest)
+
+
+def load_manifest():
+    """
+    Read the manifest of input files from the last run,
+    {path: {"mtime": ..., "size": ..., "sids": [...]}}.
+    """
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def changed_inputs(manifest, input_directory):
+    """
+    Compare the files in `input_directory` with `manifest`.
+    Returns (changed, removed): the names of new or modified
+    files, and the names of files which have disappeared.
+    Files are compared by modification time and size.
+    """
+    changed = []
+    current = set()
+    for filename in sorted(os.listdir(input_directory)):
+        path = os.path.join(input_directory, filename)
+        current.add(path)
+        state = file_state(path)
+        known = manifest.get(path, {})
+        if (known.get("mtime"), known.get("size")) != (state["mtime"], state["size"]):
+            changed.append(filename)
+
+    removed = [
+        os.path.basename(path)
+        for path in manifest
+        if os.path.dirname(path) == input_directory and path not in current
+    ]
+    return changed, removed
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def wrf_sid(filename):
+    """CCSM4_PAFA.csv -> PAFA, PAFA.csv -> PAFA"""
+    return os.path.splitext(filename)[0].split("_", 1)[-1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess Community Winds data")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes for the future roses (default: all cores)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="reprocess everything, not just inputs changed since the last run",
+    )
+    parser.add_argument(
+        "--append",
+        nargs="+",
+        metavar="FILE",
+        help="merge new IEM station observations into the station outputs and exit",
+    )
+    args = parser.parse_args()
+
+    if args.append:
+        append_observations(args.append)
+        parser.exit()
+
+    # Without a manifest from an earlier run, everything is rebuilt.
+    # Otherwise only stations/places whose input files changed are
+    # reprocessed, and their rows spliced into the outputs.
+    manifest = {} if args.full else load_manifest()
+    incremental = bool(manifest)
+
+    # Make already-done V2 work skippable.
+    v2_preprocess = True
+    if v2_preprocess:
+        # process_threshold_percentiles()
+        process_delta_percentiles()
+        process_threshold_events()
+        changed, removed = changed_inputs(manifest, wrf_directory)
+        removed_sids = {wrf_sid(filename) for filename in removed}
+        sids = sorted({wrf_sid(filename) for filename in changed} - removed_sids)
+        if changed or not incremental:
+            process_future_roses(args.jobs, sids if incremental else None)
+        if removed_sids and incremental:
+            remove_future_roses(removed_sids)
+        for filename in removed:
+            del manifest[os.path.join(wrf_directory, filename)]
+        for filename in changed:
+            path = os.path.join(wrf_directory, filename)
+            manifest[path] = {**file_state(path), "sids": [wrf_sid(filename)]}
+        save_manifest(manifest)
+
+    # Make all V1 work skippable.
+    v1_preprocess = False
+
+    if v1_preprocess:
+        changed, removed = changed_inputs(manifest, directory)
+        removed_sids = set()
+        for filename in removed:
+            removed_sids.update(manifest.pop(os.path.join(directory, filename))["sids"])
+
+        # Stations a changed file used to hold lose data too.
+        for filename in changed:
+            known = manifest.get(os.path.join(directory, filename), {})
+            removed_sids.update(known.get("sids", []))
+        known_sids = {
+            os.path.basename(path): known["sids"]
+            for path, known in manifest.items()
+            if os.path.dirname(path) == directory
+        }
+
+        if changed or removed or not incremental:
+            file_sids = preprocess_stations(
+                changed if incremental else None, removed_sids, known_sids
+            )
+            sids = None
+            if incremental:
+                sids = sorted(removed_sids.union(*file_sids.values()))
+
+            stats = monthly_stats(
+                read_stations(["sid", "year", "month", "direction", "speed"], sids=sids)
+            )
+            counts = rose_counts(
+                read_stations(
+                    ["sid", "direction", "speed", "month"], roses=True, sids=sids
+                ).compute()
+            )
+            process_station_aggregates(stats, counts, sids)
 
-    process_calm(mean_data)
-    # averages_by_month(mean_data)
-    # process_roses(data)
+            for filename, station_sids in file_sids.items():
+                path = os.path.join(directory, filename)
+                manifest[path] = {**file_state(path), "sids": station_sids}
+            save_manifest(manifest)
@@ -0,0 +1,117 @@
+"""
+
+Concurrency stress test for the app's server callbacks.
+
+Builds the expected response for a sample of inputs one at a
+time, then sends the same requests from many threads at once
+(through Flask's test client, so through Dash, the figure
+cache and the figure store as in production) and checks every
+response matches.  A callback relying on shared mutable state
+would return another request's figure here:
+
+    python stress_app.py --threads 16 --requests 2000
+
+Run from the directory with the data files.  A small cache
+size (CW_CACHE_SIZE, default here 8) keeps the cache evicting
+and rebuilding figures while the threads run.
+
+"""
+
+# pylint: disable=invalid-name, import-outside-toplevel
+import os
+import json
+import time
+import random
+import argparse
+import threading
+
+
+def request_payload(dependency, values):
+    """Dash's request body for the callback `dependency`."""
+    outputs = dependency["output"].strip(".").split("...")
+    return {
+        "output": dependency["output"],
+        "outputs": [
+            dict(zip(["id", "property"], output.split("."))) for output in outputs
+        ],
+        "inputs": [
+            {"id": i["id"], "property": i["property"], "value": values[i["id"]]}
+            for i in dependency["inputs"]
+        ],
+        "changedPropIds": [],
+        "state": [],
+    }
+
+
+def call(client, payload):
+    """Return the parsed response of a callback request."""
+    response = client.post("/_dash-update-component", json=payload)
+    return response.status_code, json.loads(response.data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test the app callbacks")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="in total")
+    parser.add_argument(
+        "--inputs", type=int, default=40, help="number of distinct inputs sampled"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("CW_CACHE_SIZE", "8")
+    import luts
+    import application
+
+    client = application.application.test_client()
+    dependency = [
+        d
+        for d in client.get("/_dash-dependencies").get_json()
+        if d["output"].startswith("..") and not d.get("clientside_function")
+    ][0]
+
+    rng = random.Random(args.seed)
+    samples = []
+    for _ in range(args.inputs):
+        values = {
+            "communities-dropdown": rng.choice(list(luts.communities.index)),
+            "duration-dropdown": rng.choice(list(luts.durations)),
+            "gcm-dropdown": rng.choice(list(luts.gcms)),
+            "decadal_selector": rng.choice(list(luts.decade_selections)),
+        }
+        samples.append(request_payload(dependency, values))
+
+    print("Building", len(samples), "expected responses...")
+    expected = [call(client, payload) for payload in samples]
+
+    failures = []
+    lock = threading.Lock()
+
+    def hammer(thread, count):
+        thread_client = application.application.test_client()
+        thread_rng = random.Random(args.seed + thread + 1)
+        for _ in range(count):
+            i = thread_rng.randrange(len(samples))
+            result = call(thread_client, samples[i])
+            if result != expected[i]:
+                with lock:
+                    failures.append(samples[i]["inputs"])
+
+    print(
+        "Sending", args.requests, "requests from", args.threads, "threads...", end=" "
+    )
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=hammer, args=(t, args.requests // args.threads))
+        for t in range(args.threads)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print("%.1fs" % (time.perf_counter() - start))
+
+    if failures:
+        print("*** %d responses differ, e.g. for %s ***" % (len(failures), failures[0]))
+        raise SystemExit(1)
+    print("All responses match.")